@@ -1,6 +1,12 @@
+import copy
+from collections.abc import Sequence
 import numpy as np
-import spatialTools as st
-import pandas as pd
+from . import elements
+from . import hostcache
+from . import instrument
+from . import ligands
+from . import spatialTools as st
+from . import xyzio
 from scipy.spatial.distance import cdist
 
 
@@ -16,9 +22,24 @@ def writeLines(lines, filename="xyzs.xyz"):
         for line in lines:
             f.write(f"{line}\n")
 
+def writeStructures(structures, filename="structures.xyz", freeze_ligand=False):
+    """
+    Writes every structure as one frame of a single multi-frame xyz file
+    """
+    def frames():
+        for i, structure in enumerate(structures):
+            coords = structure.complex_coords
+            frozen = np.arange(len(coords)) >= len(structure.coords) if freeze_ligand else None
+            instrument.count("structures_written")
+            yield structure.complex_atoms, coords, f"structure {i}", frozen
+
+    with instrument.stage("write"):
+        xyzio.write_xyz(filename, frames())
+
 class Atom:
     """
     A class that represents an atom in a molecule
+    Atoms are lightweight views, the formatted xyz lines are only built when they are asked for
 
     atom_type: str
         The element of the atom
@@ -26,35 +47,91 @@ class Atom:
         The xyz coordinates of the atom
     index: int
         The index of the atom in the xyz file
+    frozen: bool
+        Whether the atom is frozen
     """
 
-    def __init__(self, xyz, atom_type, index):
-        self.point = xyz
+    __slots__ = ('coords', 'element', 'index', 'frozen')
+
+    def __init__(self, xyz, atom_type, index, frozen=False):
         self.coords = xyz
-        self.x = xyz[0]
-        self.y = xyz[1]
-        self.z = xyz[2]
         self.index = index
         self.element: str = atom_type
-        self.frozen_line = f"{self.element:<2}{-1:^4}{xyz[0]:>15.5f}{xyz[1]:>15.5f}{xyz[2]:>15.5f}"
-        self.labile_line = f"{self.element:<2}{0:^4}{xyz[0]:>15.5f}{xyz[1]:>15.5f}{xyz[2]:>15.5f}"
-        self.line = f"{self.element:<2}{xyz[0]:>15.5f}{xyz[1]:>15.5f}{xyz[2]:>15.5f}"
+        self.frozen = frozen
+
+    @property
+    def point(self):
+        return self.coords
+
+    @property
+    def x(self):
+        return self.coords[0]
+
+    @property
+    def y(self):
+        return self.coords[1]
+
+    @property
+    def z(self):
+        return self.coords[2]
+
+    @property
+    def frozen_line(self) -> str:
+        xyz = self.coords
+        return f"{self.element:<2}{-1:^4}{xyz[0]:>15.5f}{xyz[1]:>15.5f}{xyz[2]:>15.5f}"
+
+    @property
+    def labile_line(self) -> str:
+        xyz = self.coords
+        return f"{self.element:<2}{0:^4}{xyz[0]:>15.5f}{xyz[1]:>15.5f}{xyz[2]:>15.5f}"
+
+    @property
+    def line(self) -> str:
+        xyz = self.coords
+        return f"{self.element:<2}{xyz[0]:>15.5f}{xyz[1]:>15.5f}{xyz[2]:>15.5f}"
     
     def __str__(self) -> str:
         return self.frozen_line
 
+class AtomViews(Sequence):
+    """
+    A lazy, read-only sequence of Atom views over the arrays of a complex
+    Atom objects are only created for the atoms that are actually accessed, and their coordinates are views into the array
+    """
+
+    __slots__ = ('elements', 'coords', 'frozen', 'indices')
+
+    def __init__(self, elements, coords, frozen=None, indices=None):
+        self.elements = elements
+        self.coords = coords
+        self.frozen = np.zeros(len(coords), dtype=bool) if frozen is None else frozen
+        self.indices = range(len(coords)) if indices is None else indices
+
+    def __len__(self) -> int:
+        return len(self.coords)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return Atom(self.coords[i], self.elements[i], self.indices[i], bool(self.frozen[i]))
+
 class Sphere:
     """
     A class that represents a sphere of points around a central atom
     Mainly used for sampling
     """
 
-    def __init__(self, xyzfile, n_points=100, cutoff=1.5):
+    def __init__(self, xyzfile, n_points=100, cutoff=1.5, radius=2.5):
 
         self.samples = n_points
         self.cutoff = cutoff
+        self.radius = radius
         self.xyzfile = xyzfile
-        self.points = st.generateSphere(xyzfile, n_points, cutoff)
+        with instrument.stage("sphere"):
+            self.points = hostcache.load(xyzfile).validPoints(n_points, cutoff, radius) #clearances are cached per host file
+        instrument.count("points_sampled", n_points)
+        instrument.count("points_accepted", len(self.points[0]))
+        instrument.count("points_rejected", len(self.points[1]))
         self.valid_points = self.points[0] #points that are within the cutoff
         self.invalid_points = self.points[1] #points that are outside the cutoff
     
@@ -64,17 +141,67 @@ class Sphere:
 class Complex:
     """
     A generic class that encodes atomic coordinates and other useful information
+
+    The complex is stored as a structure of arrays
+    numbers: np.ndarray
+        Atomic number of every atom (see elements.py)
+    coords: np.ndarray
+        (N,3) array of coordinates, with the first atom at the origin
+    frozen: np.ndarray
+        Boolean (N,) array of frozen atoms
     """
 
-    def __init__(self, xyzfile) -> None:
+    def __init__(self, xyzfile, cache: bool = True) -> None:
         
-        #Unpack the xyz file
-        self.coords, self.atoms, self.indices, self.dists = st.from_xyz(xyzfile)
-        #Populate the complex with atom objects
-        self.Atoms = [Atom(self.coords[i], self.atoms[i], self.indices[i]) for i in range(len(self.atoms))]
+        #Unpack the xyz file, the parsed arrays are read-only and shared by every complex built from the same file (see hostcache.py)
+        self.host = hostcache.load(xyzfile, cache)
+        self.coords = self.host.coords
+        self.numbers = self.host.numbers
+        self.frozen = self.host.frozen
+        self.indices = list(range(len(self.coords)))
+        self._tree = None
+        self._tree_coords = None
+
+    @property
+    def atoms(self) -> list[str]:
+        """
+        Element symbols of the complex
+        """
+        if getattr(self, '_atoms_numbers', None) is not self.numbers:
+            self._atoms = elements.element_symbols(self.numbers)
+            self._atoms_numbers = self.numbers
+        return self._atoms
+
+    @property
+    def Atoms(self) -> AtomViews:
+        """
+        Lazy Atom views of the complex
+        """
+        return AtomViews(self.atoms, self.coords, self.frozen, self.indices)
+
+    @property
+    def dists(self):
+        """
+        Distance matrix of the complex, computed on first use
+        """
+        if getattr(self, '_dists_coords', None) is not self.coords:
+            self._dists = cdist(self.coords, self.coords)
+            self._dists_coords = self.coords
+        return self._dists
+
+    @property
+    def tree(self):
+        """
+        Spatial index of the atomic coordinates, rebuilt only when the coordinates change
+        """
+        if self._tree is None or self._tree_coords is not self.coords:
+            self._tree = self.host.tree if self.host is not None and self.coords is self.host.coords else st.spatial_index(self.coords)
+            self._tree_coords = self.coords
+        return self._tree
 
     def as_dataframe(self):
         #combine all the data into a pandas dataframe
+        import pandas as pd
         return pd.DataFrame({'atom': self.atoms, 'x': self.coords[:, 0], 'y': self.coords[:, 1], 'z': self.coords[:, 2]})
 
     def __str__(self): #honestly, this is the nicest way to print the complex
@@ -83,45 +210,109 @@ class Complex:
 class Ligand(Complex):
     """
     Represents a ligand
+    The donor atom and the binding axis are detected from the geometry (see ligands.py) and the donor is put at the origin
     """
 
-    #currently only works for thf
     def __init__(self, xyzfile) -> None:
-        super().__init__(xyzfile)
-        self.ligand_axis = self.coords[0] - ((self.coords[1] + self.coords[2])/2) #this needs to be changed later
+        super().__init__(xyzfile, cache=False) #ligands are cheap to parse and have no clearances worth keeping
+        bonds = st.perceive_bonds(self.numbers, self.coords)
+        self.donor = ligands.find_donor(self.numbers, self.coords, bonds)
+        self.coords = self.coords - self.coords[self.donor]
+        self.ligand_axis = ligands.binding_axis(self.coords, self.donor, bonds)
+
+class LigandGroup(Complex):
+    """
+    Several ligands stored as one, the ligand of a structure with more than one ligand (see multiligand.py)
+    The atoms of the ligands are concatenated in order, donors holds the index of every donor in the concatenated atoms
+    and offsets the index of the first atom of every ligand
+    There is no single binding axis, ligand_axis is None
+    """
+
+    def __init__(self, ligands: list[Ligand]) -> None:
+        self.ligands = list(ligands)
+        self.host = None
+        self.numbers = np.concatenate([ligand.numbers for ligand in self.ligands])
+        self.coords = np.concatenate([ligand.coords for ligand in self.ligands])
+        self.frozen = np.concatenate([ligand.frozen for ligand in self.ligands])
+        self.indices = list(range(len(self.coords)))
+        self._tree = None
+        self._tree_coords = None
+        self.offsets = np.cumsum([0] + [len(ligand.coords) for ligand in self.ligands[:-1]])
+        self.donors = self.offsets + [ligand.donor for ligand in self.ligands]
+        self.ligand_axis = None
 
 
 class CoordinationComplex(Complex):
 
     def __init__(self, xyzfile: str, ligand_xyzfile: str) -> None:
         super().__init__(xyzfile)
-        self.ligand = Ligand(ligand_xyzfile)
-        self.ligand_axis = self.ligand.ligand_axis
-        self.ligand_coords = self.ligand.coords
-        self.ligand_atoms = self.ligand.atoms
-        self.ligand_indices = self.ligand.indices
-        self.ligand_Atoms = self.ligand.Atoms
-        
-        
-        self.complex_atoms = self.atoms + self.ligand_atoms
-        self.complex_coords = np.concatenate((self.coords, self.ligand_coords))
-        self.distance_matrix = cdist(self.complex_coords, self.complex_coords)
+        self.set_ligand(Ligand(ligand_xyzfile))
+
+    def set_ligand(self, ligand):
+        """
+        Makes ligand (a Ligand, or a LigandGroup for several ligands) the unplaced ligand of the complex
+        """
+        self.ligand = ligand
+        self.ligand_axis = ligand.ligand_axis
+        self.ligand_coords = ligand.coords
+        self.ligand_atoms = ligand.atoms
+        self.ligand_indices = ligand.indices
+        return self
+
+    @property
+    def ligand_Atoms(self) -> AtomViews:
+        """
+        Lazy Atom views of the (placed) ligand
+        """
+        return AtomViews(self.ligand_atoms, self.ligand_coords, indices=self.ligand_indices)
+
+    @property
+    def complex_atoms(self) -> list[str]:
+        return self.atoms + self.ligand_atoms
+
+    @property
+    def complex_coords(self) -> np.ndarray:
+        return np.concatenate((self.coords, self.ligand_coords))
+
+    @property
+    def complex_indices(self) -> list[int]:
+        return list(range(len(self.atoms) + len(self.ligand_atoms)))
+
+    @property
+    def distance_matrix(self) -> np.ndarray:
+        """
+        Distance matrix of host + ligand, computed on demand
+        """
+        complex_coords = self.complex_coords
+        return cdist(complex_coords, complex_coords)
 
     def orient_ligand(self, point):
         """
         Orients the ligand axis so that it is pointing towards the central atom
         """
-        ligand_axis = self.ligand_axis #this is the axis of the ligand
-        ligand_coords = self.ligand_coords #these are the coordinates we must rotate
-
-        mat = st.rotation_matrix(ligand_axis, point) #get the rotation matrix
-        new_vecs = [ mat @ coord + point for coord in ligand_coords]
-        ligand_coords = np.reshape(new_vecs, (len(new_vecs),3)) #rotate the ligand around the central atom and translate
+        ligand_coords = self.place_ligands([point])[0] #always start from the unperturbed ligand
 
         setattr(self, 'ligand_coords', ligand_coords) #set the new coordinates
 
         return self
 
+    def place_ligands(self, points) -> np.ndarray:
+        """
+        Orients the ligand onto every point at once
+        Returns a (P, n_ligand, 3) array of ligand coordinates, one independent copy per point
+        """
+        return st.place_ligand(self.ligand.coords, self.ligand_axis, points)
+
+    def with_ligand(self, ligand_coords, site=None):
+        """
+        Returns an independent copy of the complex with the ligand at ligand_coords
+        site optionally records the sampling site (see spatialTools.searchSites) the ligand was placed on
+        """
+        structure = copy.copy(self)
+        structure.site = site
+        structure.ligand_coords = ligand_coords
+        return structure
+
 
     def plot_CoordinationComplex(self, point=None):
         import plotly.graph_objects as go
@@ -148,31 +339,22 @@ class CoordinationComplex(Complex):
         """
         Rotates the ligand around an axis by an angle theta
         """
-        self.ligand_coords = st.rotate(self.ligand_coords, theta, axis)
-        self.ligand.axis = st.rotate(self.ligand.axis, theta, axis)
-        self.ligand.Atoms = [Atom(self.ligand_coords[i], self.ligand.atoms[i], self.ligand.indices[i]) for i in range(len(self.ligand.atoms))]
+        self.ligand_coords = self.ligand_coords @ st.axis_rotation_matrix(axis, theta).T
 
     def rotate(self, theta, axis):
         """
         Rotates the complex around an axis by an angle theta
         """
-        self.coords = st.rotate(self.coords, theta, axis)
-        self.ligand_coords = st.rotate(self.ligand_coords, theta, axis)
-        self.ligand.axis = st.rotate(self.ligand.axis, theta, axis)
-        self.axis = st.rotate(self.axis, theta, axis)
-        self.Atoms = [Atom(self.coords[i], self.atoms[i], self.indices[i]) for i in range(len(self.atoms))]
-        self.ligand.Atoms = [Atom(self.ligand_coords[i], self.ligand.atoms[i], self.ligand.indices[i]) for i in range(len(self.ligand.atoms))]
+        mat = st.axis_rotation_matrix(axis, theta).T
+        self.coords = self.coords @ mat
+        self.ligand_coords = self.ligand_coords @ mat
 
     def translate(self, vector):
         """
         Translates the complex by a vector
         """
-        self.coords = st.translate(self.coords, vector)
-        self.ligand_coords = st.translate(self.ligand_coords, vector)
-        self.ligand.axis = st.translate(self.ligand.axis, vector)
-        self.axis = st.translate(self.axis, vector)
-        self.Atoms = [Atom(self.coords[i], self.atoms[i], self.indices[i]) for i in range(len(self.atoms))]
-        self.ligand.Atoms = [Atom(self.ligand_coords[i], self.ligand.atoms[i], self.ligand.indices[i]) for i in range(len(self.ligand.atoms))]
+        self.coords = self.coords + vector
+        self.ligand_coords = self.ligand_coords + vector
 
     def __str__(self) -> str:
         return f"Coordination Complex with {len(self.atoms)} atoms and {len(self.ligand.atoms)} ligand atoms"
@@ -180,53 +362,122 @@ class CoordinationComplex(Complex):
     def save(self, filename=f"coordination_complex.xyz", freeze_ligand=False):
         """
         Saves the complex to an xyz file
+        With freeze_ligand the ligand atoms are flagged as frozen (-1) and the host atoms as labile (0)
         """
-        
+        frozen = None
         if freeze_ligand:
+            frozen = np.arange(len(self.atoms) + len(self.ligand_atoms)) >= len(self.atoms)
 
-            lines = [atom.labile_line for atom in self.Atoms]
-            #replace the ligand line with the frozen ligand line
-            lines.extend([self.Atoms[i].frozen_line if i in self.ligand.indices else self.Atoms[i].line for i in range(len(self.Atoms))])
-            writeLines(lines, filename)
-                
-        else:
-            
-            lines = [atom.line for atom in self.Atoms]
-            lines.extend([atom.line for atom in self.ligand.Atoms])
-            writeLines(lines, filename)
+        with instrument.stage("write"):
+            xyzio.write_xyz(filename, [(self.complex_atoms, self.complex_coords, "", frozen)])
+        instrument.count("structures_written")
 
 
     def as_dataframe(self):
         """
         combine all the coordination complex attributes into a pandas dataframe
         """
-        import pandas as pd 
+        import pandas as pd
         return pd.DataFrame({'atom': self.complex_atoms, 'index': self.complex_indices, 'x': self.complex_coords[:, 0], 'y': self.complex_coords[:, 1], 'z': self.complex_coords[:, 2]})
 
 
-def generateStructures(xyzfile: str, ligand_xyzfile: str) -> list[CoordinationComplex]:
+def generateStructures(xyzfile: str, ligand_xyzfile: str, n_points: int = 100, cutoff: float = 1.5, radii=None, refine_samples: int = 50, n_spins: int = 0) -> list[CoordinationComplex]:
     """
     Generates a list of CoordinationComplex objects from an xyz file
+    By default a single sphere of n_points is sampled, passing radii switches to the multi-shell coarse-to-fine search (spatialTools.searchSites)
+    With n_spins the ligand is also spun about its binding axis and the least hindered spin is kept (spatialTools.spin_scan)
     Returns a list of CoordinationComplex objects
     """
-    complex = CoordinationComplex(xyzfile, ligand_xyzfile) #generate a sampling sphere around the central atom
-    points = Sphere(xyzfile, 100, 1.5).valid_points #collect only the valid points
-    structures = [complex.orient_ligand(point) for point in points] #create a list of structures with the ligand oriented around the central atom
+    with instrument.stage("read"):
+        complex = CoordinationComplex(xyzfile, ligand_xyzfile) #generate a sampling sphere around the central atom
+
+    if radii is None:
+        points = Sphere(xyzfile, n_points, cutoff).valid_points #collect only the valid points
+        sites = [None] * len(points)
+    else:
+        with instrument.stage("sphere"):
+            sites = complex.host.searchSites(radii, n_points, cutoff, refine_samples)
+        points = sites['point']
+        instrument.count("points_accepted", len(points))
+
+    with instrument.stage("placement"):
+        placements = complex.place_ligands(points) #orient the ligand onto every valid point in one batch
+        if n_spins:
+            placements, *_ = st.spin_scan(placements, points, complex.tree, n_spins)
+        structures = [complex.with_ligand(ligand_coords, site) for ligand_coords, site in zip(placements, sites)] #one independent structure per point
+    instrument.count("structures_generated", len(structures))
 
     return structures
 
 
+def screenHost(coords, ligand: Ligand, n_points: int = 100, cutoff: float = 1.5, clash_cutoff: float = None, radii=(2.5,), refine_samples: int = 0, n_spins: int = 0, relax: bool = False, tree=None, host=None, sites=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Samples, places and clash-filters one ligand around a host given as a coordinate array
+    With the defaults this is a single sphere of n_points, as in generateStructures
+    With n_spins every placement is replaced by its least hindered spin about the binding axis before filtering
+    With relax, near-miss rejections are relaxed as rigid bodies against the host (chemistry.relax_placements) and kept if they no longer clash
+    host is the hostcache.Host of coords, when given its cached clearances and tree are used so repeated screens skip the sphere search
+    sites replaces the sphere search with given sites (SITE_DTYPE), e.g. the pocket openings of cavity.searchPockets
+    Returns the accepted sites (spatialTools.SITE_DTYPE) and the matching (S, n_ligand, 3) ligand coordinates
+    """
+    if host is not None:
+        tree = host.tree
+    elif tree is None:
+        tree = st.spatial_index(coords)
+    if clash_cutoff is None:
+        clash_cutoff = cutoff
+
+    with instrument.stage("sphere"):
+        if sites is not None:
+            sites = np.array(sites, dtype=st.SITE_DTYPE) #relax moves the sites, never those of the caller
+        elif host is not None:
+            sites = host.searchSites(radii, n_points, cutoff, refine_samples)
+        else:
+            sites = st.searchSites(coords, radii, n_points, cutoff, refine_samples, tree=tree)
+    instrument.count("points_accepted", len(sites))
+
+    with instrument.stage("placement"):
+        placements = st.place_ligand(ligand.coords, ligand.ligand_axis, sites['point'])
+        if n_spins:
+            placements, _, distances = st.spin_scan(placements, sites['point'], tree, n_spins)
+
+    with instrument.stage("filter"):
+        keep = distances >= clash_cutoff if n_spins else ~st.clashes(placements, tree, clash_cutoff)
+    if relax and not keep.all():
+        from . import chemistry
+        with instrument.stage("relax"):
+            #only near misses are worth relaxing, buried placements cannot be pushed out by a small rigid-body move
+            rejected = np.flatnonzero(~keep & (st.clearance(placements, tree).min(axis=1) >= clash_cutoff - 0.5))
+            relaxed, pivots, distances = chemistry.relax_placements(placements[rejected], tree, coords, sites['point'][rejected], r_rep=clash_cutoff + 0.5)
+            placements[rejected], sites['point'][rejected] = relaxed, pivots
+            sites['clearance'][rejected] = st.clearance(pivots, tree)
+            keep[rejected] = distances >= clash_cutoff
+        instrument.count("structures_relaxed", keep[rejected].sum())
+    instrument.count("structures_accepted", keep.sum())
+    instrument.count("structures_rejected", len(keep) - keep.sum())
+
+    return sites[keep], placements[keep]
+
+
 def filterStructures(structures: list[CoordinationComplex], cutoff_distance: float) -> list[CoordinationComplex]:
     '''
-    Filters structures that have atoms too close to other atoms
+    Filters structures that have ligand atoms too close to atoms of the host complex
     '''
-    #get distances between all atoms in the complex
-    distances = [distance(structures[i].Atoms[j], structures[i].Atoms[k]) for i in range(len(structures)) for j in range(len(structures[i].Atoms)) for k in range(len(structures[i].Atoms)) if j != k]
-    #get the indices of the structures with distances less than the cutoff distance
-    indices = [i for i in range(len(structures)) if any([distances[i*len(structures[i].Atoms) + j*len(structures[i].Atoms) + k] < cutoff_distance for j in range(len(structures[i].Atoms)) for k in range(len(structures[i].Atoms)) if j != k])]
-    #filter the structures
-    structures = [structures[i] for i in range(len(structures)) if i not in indices]
-    return structures
+    #structures generated from the same host share its coordinates, so group them and check each group in one batch
+    groups = {}
+    for i, structure in enumerate(structures):
+        groups.setdefault(id(structure.coords), []).append(i)
+
+    keep = np.ones(len(structures), dtype=bool)
+    with instrument.stage("filter"):
+        for indices in groups.values():
+            tree = structures[indices[0]].tree
+            placed = np.stack([structures[i].ligand_coords for i in indices])
+            keep[indices] = ~st.clashes(placed, tree, cutoff_distance)
+    instrument.count("structures_accepted", keep.sum())
+    instrument.count("structures_rejected", len(keep) - keep.sum())
+
+    return [structure for structure, kept in zip(structures, keep) if kept]
 
 def distance(atom1: Atom, atom2: Atom) -> float:
     """
@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+from . import xyzio
+
+
+#per-candidate metadata, stored next to the float32 ligand coordinates
+CANDIDATE_DTYPE = np.dtype([('point', np.float32, 3), ('radius', np.float32), ('shell', np.int16), ('clearance', np.float32), ('score', np.float32)])
+
+
+class ArchiveWriter:
+    """
+    Streams screening results into a candidate archive
+
+    The archive is an uncompressed .npz file that stores the host once and, per candidate, the ligand coordinates as float32
+    together with its site metadata (CANDIDATE_DTYPE). Candidates are appended in batches and spooled to disk, so memory
+    stays bounded however many candidates are written.
+    """
+
+    def __init__(self, filename: str, host_elements, host_coords, ligand_elements) -> None:
+
+        self.filename = filename
+        self.host_elements = np.asarray(host_elements, dtype='U3')
+        self.host_coords = np.asarray(host_coords, dtype=float)
+        self.ligand_elements = np.asarray(ligand_elements, dtype='U3')
+        self.n_candidates = 0
+
+        #raw spool files, the .npy headers are only written once the final shape is known
+        self._coords = tempfile.TemporaryFile()
+        self._sites = tempfile.TemporaryFile()
+
+    def add(self, sites, ligand_coords, scores=None):
+        """
+        Appends a batch of candidates
+        sites is a structured array with (a subset of) the CANDIDATE_DTYPE fields, e.g. the output of spatialTools.searchSites
+        ligand_coords is the matching (S, n_ligand, 3) array of placed ligands
+        """
+        ligand_coords = np.asarray(ligand_coords, dtype=np.float32).reshape(-1, len(self.ligand_elements), 3)
+
+        records = np.zeros(len(ligand_coords), dtype=CANDIDATE_DTYPE)
+        records['score'] = np.nan
+        for name in CANDIDATE_DTYPE.names:
+            if sites is not None and name in (sites.dtype.names or ()):
+                records[name] = sites[name]
+        if scores is not None:
+            records['score'] = scores
+
+        self._coords.write(np.ascontiguousarray(ligand_coords).tobytes())
+        self._sites.write(records.tobytes())
+        self.n_candidates += len(records)
+
+    def close(self):
+        """
+        Writes the archive to disk
+        The archive is assembled next to filename and moved into place at the end, so a failed write never leaves a truncated archive
+        """
+        fd, staging = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.filename)), suffix=".npz")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self._write(f)
+            os.replace(staging, self.filename)
+        except BaseException:
+            os.unlink(staging)
+            raise
+        finally:
+            self.discard()
+
+    def discard(self):
+        """
+        Drops the spooled candidates without writing anything
+        """
+        self._coords.close()
+        self._sites.close()
+
+    def _write(self, f):
+        with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, array in (('host_elements', self.host_elements), ('host_coords', self.host_coords), ('ligand_elements', self.ligand_elements)):
+                with zf.open(f"{name}.npy", 'w') as member:
+                    np.lib.format.write_array(member, array)
+
+            spools = (('ligand_coords', self._coords, np.dtype(np.float32), (self.n_candidates, len(self.ligand_elements), 3)),
+                      ('candidates', self._sites, CANDIDATE_DTYPE, (self.n_candidates,)))
+            for name, spool, dtype, shape in spools:
+                with zf.open(f"{name}.npy", 'w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_2_0(member, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, member)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard() #a block that raised would leave an archive that looks complete but is not
+
+
+def _memmap_member(filename: str, name: str) -> np.ndarray:
+    """
+    Memory-maps one stored .npy member of an uncompressed .npz file
+    """
+    with zipfile.ZipFile(filename) as zf:
+        info = zf.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError(f"{name} in {filename} is compressed and cannot be memory-mapped")
+
+    with open(filename, 'rb') as f:
+        #skip the zip local file header to reach the .npy data
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = (int(n) for n in np.frombuffer(f.read(4), dtype='<u2'))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C')
+
+
+class CandidateArchive:
+    """
+    Random access reader for archives written by ArchiveWriter
+    Candidate coordinates and metadata are memory-mapped, so reading candidate i costs the same for any i
+    """
+
+    def __init__(self, filename: str) -> None:
+
+        self.filename = filename
+        with np.load(filename) as npz:
+            self.host_elements = npz['host_elements'].tolist()
+            self.host_coords = npz['host_coords']
+            self.ligand_elements = npz['ligand_elements'].tolist()
+        self.ligand_coords = _memmap_member(filename, 'ligand_coords')
+        self.candidates = _memmap_member(filename, 'candidates')
+
+    def __len__(self) -> int:
+        return len(self.candidates)
+
+    def __str__(self) -> str:
+        return f"Candidate archive with {len(self)} candidates of a {len(self.host_elements)} atom host and {len(self.ligand_elements)} atom ligand"
+
+    def structure(self, i: int):
+        """
+        Returns the elements and (N,3) coordinates of host + ligand for candidate i
+        """
+        elements = self.host_elements + self.ligand_elements
+        coords = np.concatenate((self.host_coords, self.ligand_coords[i].astype(float)))
+        return elements, coords
+
+    def to_xyz(self, i: int, filename: str):
+        """
+        Exports candidate i as an xyz file
+        """
+        elements, coords = self.structure(i)
+        xyzio.write_xyz(filename, [(elements, coords, f"candidate {i}")])
+
+    def to_coord(self, i: int, filename: str = "coord", freeze_host: bool = False):
+        """
+        Exports candidate i as a TURBOMOLE coord file, optionally with the host atoms frozen
+        """
+        elements, coords = self.structure(i)
+        frozen = np.arange(len(coords)) < len(self.host_elements) if freeze_host else None
+        xyzio.write_coord(filename, elements, coords, frozen)
+
+    def export(self, indices, directory: str, fmt: str = "xyz"):
+        """
+        Exports a selection of candidates into directory, as xyz files or as one TURBOMOLE coord per candidate subdirectory
+        """
+        os.makedirs(directory, exist_ok=True)
+        for i in indices:
+            if fmt == "xyz":
+                self.to_xyz(i, os.path.join(directory, f"candidate_{i}.xyz"))
+            elif fmt == "coord":
+                os.makedirs(os.path.join(directory, f"candidate_{i}"), exist_ok=True)
+                self.to_coord(i, os.path.join(directory, f"candidate_{i}", "coord"))
+            else:
+                raise ValueError(f"Unknown export format {fmt}, expected 'xyz' or 'coord'")
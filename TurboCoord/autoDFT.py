@@ -1,28 +1,97 @@
 import sys
-from pexpect import popen_spawn
-import yaml 
-from turbomoleio.input.define import DefineRunner
 import os
+import glob
+import hashlib
+import json
+import shutil
+import tempfile
+from . import instrument
 
-def define(yaml_file: str ="parameters.yaml", convert_xyz: bool=False, xyz_file: str = "*.xyz"):
+#templates produced by define are cached here, keyed on the parameter set and the atom sequence
+DEFINE_CACHE = os.environ.get("TURBOCOORD_DEFINE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "turbocoord", "define"))
+TEMPLATE_FILES = ("control", "basis", "auxbasis", "mos", "alpha", "beta")
+
+def coordElements(coord_file: str = "coord") -> list[str]:
+    """
+    Returns the element of every atom in a TURBOMOLE coord file, in order
+    """
+    from . import xyzio
+    return [element.lower() for element in xyzio.read_coord(coord_file).elements]
+
+def defineKey(parameters: dict, atoms: list[str]) -> str:
+    """
+    Hash of a define parameter set and the atom sequence it is applied to
+    The atom order matters because control lists basis sets per atom index
+    """
+    payload = json.dumps({"parameters": parameters, "atoms": atoms}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def cacheable(parameters: dict) -> bool:
+    """
+    Templates can only be reused when define does not derive anything from the geometry itself:
+    no redundant internal coordinates and a fixed c1 point group
+    """
+    return not parameters.get("ired") and str(parameters.get("sym")).lower() == "c1"
+
+def define(yaml_file: str ="parameters.yaml", convert_xyz: bool=False, xyz_file: str = "*.xyz", workdir: str = ".", cache: bool = True):
     """
         Takes coord file and parameter.yaml file and creates all requisite files for TURBOMOLE calculation
 
         yaml_file: filename for the yaml file that contains the user's specified TURBOMOLE parameters
         convert_xyz: a boolean to specify if there is an existing xyz file to be converted to TURBOMOLE coord format
         xyz_file: chooses the xyz file present in the current directory as default, but can be changed to an alternative file
+        workdir: directory of the calculation, yaml_file and xyz_file are relative to it
+        cache: reuse the files of an earlier define run with the same parameters and atoms (see DEFINE_CACHE)
+               instead of starting the interactive define session
 
         Output: alpha, basis, auxbasis, control, coord (iff convert_xyz == True) 
     """
-    
+    #define needs the TURBOMOLE tooling, the bookkeeping commands of this module do not
+    import yaml
+    from . import xyzio
+
     if convert_xyz: 
         
-        os.system(f"x2t {xyz_file} > coord") #use the builtin TURBOMOLE command 'x2t' to convert coord
+        xyz_file = sorted(glob.glob(os.path.join(workdir, xyz_file)))[0] #the pattern may match several files, take the first
+        xyzio.xyz_to_coord(xyz_file, os.path.join(workdir, "coord")) #convert to TURBOMOLE coord without calling x2t
 
-    with open(yaml_file, "r") as fh:
+    with open(os.path.join(workdir, yaml_file), "r") as fh:
         dp = yaml.load(fh, Loader=yaml.SafeLoader)
-        dr = DefineRunner(parameters=dp)
+
+    cache = cache and cacheable(dp)
+    if cache:
+        template = os.path.join(DEFINE_CACHE, defineKey(dp, coordElements(os.path.join(workdir, "coord"))))
+        if os.path.exists(os.path.join(template, "control")):
+            with instrument.stage("define_cached"):
+                for filename in os.listdir(template):
+                    shutil.copy2(os.path.join(template, filename), workdir)
+            instrument.count("define_cache_hits")
+            return
+
+    with instrument.stage("define"):
+        from turbomoleio.input.define import DefineRunner
+        dr = DefineRunner(parameters=dp, workdir=workdir)
         dr.run_full()
+    instrument.count("define_runs")
+
+    if cache:
+        #stage the templates next to their final location and move them in atomically, so concurrent runs never see half a template
+        os.makedirs(DEFINE_CACHE, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=DEFINE_CACHE)
+        for filename in TEMPLATE_FILES:
+            if os.path.exists(os.path.join(workdir, filename)):
+                shutil.copy2(os.path.join(workdir, filename), staging)
+        try:
+            os.rename(staging, template)
+        except OSError: #another run stored the same template first
+            shutil.rmtree(staging)
+
+def defineAll(dirs, yaml_file: str = "parameters.yaml"):
+    """
+    Runs define in many calculation directories, only the first directory of every distinct parameter set and atom sequence starts define
+    """
+    for dir in dirs:
+        define(yaml_file, workdir=dir)
     
 def fixturbo():
     """
@@ -31,88 +100,212 @@ def fixturbo():
     os.system(f'sed -i "s/scforbitalshift  closedshell=.05/scforbitalshift  closedshell=.3 /" control')
 
 
-def nextCycle():
-
-    if isConverged == False:
-        print("It is inadvisable to continue, breaking now")
-        quit()
-    
-    os.system("mkdir next_step ; cd next_step ; cp ../coord . ; cp ../*.pbs ; cp ../parameters.yaml . ; python3 ~/.execs/autoDFT.py define")
-
+#marker files written by jobex, in order of precedence
+STATES = ("GEO_OPT_CONVERGED", "GEO_OPT_FAILED", "GEO_OPT_RUNNING")
 
-def autoSubmit(dir: str="."):
+def calculationState(dir: str = "."):
     """
-    Checks each directory to see if a calculation has been completeed, and if so, creates a new directory run the next job
+    Returns the marker file (one of STATES) present in a calculation directory, or None if there is none yet
     """
-    #iterate over each directory in the current directory
-    for subdir in os.listdir(dir):
-        #if the directory is a directory
-        if os.path.isdir(subdir):
-            #change to the directory
-            os.chdir(subdir)
-            #check if the calculation has converged
-            if isConverged():
-                #summarize the results
-                summarize()
-                #archive the files
-                archive()
-                #if so, create a new directory and run the next job
-                nextCycle()
-            #change back to the original directory
-            os.chdir("..")
-
-def isConverged():
+    files = set(os.listdir(dir))
+    for state in STATES:
+        if state in files:
+            return state
+    return None
+
+def isConverged(dir: str = "."):
     """
     Checks current folder to see if the file "GEO_OPT_CONVERGED" exists
     """
-    if os.path.exists("GEO_OPT_FAILED"):
+    if os.path.exists(os.path.join(dir, "GEO_OPT_FAILED")):
         print("This geometry optimization failed, please consider the parameters and orginal geometry given at the beginning of the optimization")
     
-    if os.path.exists("GEO_OPT_RUNNING"):
+    if os.path.exists(os.path.join(dir, "GEO_OPT_RUNNING")):
         print("Your calculation timed out, consider restarting your calculation")
 
-    return os.path.exists("GEO_OPT_CONVERGED")
+    return os.path.exists(os.path.join(dir, "GEO_OPT_CONVERGED"))
 
-def nextCycle():
+def nextCycle(dir: str = "."):
     """
     Creates a new directory and runs the next job
     """
-    os.system("mkdir next_step ; cd next_step ; cp ../coord . ; cp ../*.pbs ; cp ../parameters.yaml . ; python3 ~/.execs/autoDFT.py define")
+    if not isConverged(dir):
+        print("It is inadvisable to continue, breaking now")
+        return
+
+    next_step = os.path.join(dir, "next_step")
+    os.makedirs(next_step, exist_ok=True)
+    for path in [os.path.join(dir, "coord"), os.path.join(dir, "parameters.yaml")] + glob.glob(os.path.join(dir, "*.pbs")):
+        shutil.copy2(path, next_step)
 
+    define(workdir=next_step)
 
-def archive():
+
+def archive(dir: str = "."):
     """
     Archives coord, energy, control, and parameters.yaml files in the current directory
     """
-    os.system("mkdir archive ; cp coord energy control parameters.yaml archive")
+    archive_dir = os.path.join(dir, "archive")
+    os.makedirs(archive_dir, exist_ok=True)
+    for filename in ("coord", "energy", "control", "parameters.yaml"):
+        if os.path.exists(os.path.join(dir, filename)):
+            shutil.copy2(os.path.join(dir, filename), archive_dir)
 
 
-def summarize():
+def summarize(dir: str = "."):
     """
     Summarizes the results of the optimization
+    Returns the record of harvest.read_record
     """
-    
-    #get the energy of the final geometry in the energy file
-    with open("energy", "r") as fh:
-        energy = fh.readlines()[-1].split()[0]
-    
-    #get the name of the current directory
-    name = os.getcwd().split("/")[-1]
+    from . import harvest
+    from . import xyzio
+
+    #get the name of the calculation directory
+    name = os.path.basename(os.path.abspath(dir))
 
     #convert the coord file to xyz format and name it after the current directory
-    os.system(f"t2x coord > {name}.xyz")
+    xyzio.coord_to_xyz(os.path.join(dir, "coord"), os.path.join(dir, f"{name}.xyz"))
 
-    #get the total scf cycles and time of the calculation from the control file
-    with open("control", "r") as fh:
-        time = fh.readlines()[0].split()[1]
-        cycles = fh.readlines()[1].split()[1]
+    #get the final energy, the scf cycles and the time of the calculation
+    record = harvest.read_record(dir)
 
     #print the results
-    print(f"Your final energy is {energy} Hartree")
-    print(f"Your final geometry is in the file final_geometry.xyz")
-    print(f"Your calculation took {time} seconds and {cycles} cycles")
+    print(f"Your final energy is {record['energy']} Hartree")
+    print(f"Your final geometry is in the file {name}.xyz")
+    print(f"Your calculation took {record['wall_time']} seconds and {record['scf_iterations']} cycles")
+
+    return record
+
+
+def advance(dir: str):
+    """
+    Summarizes, archives and starts the next cycle of one converged calculation
+    """
+    with instrument.stage("summarize"):
+        summarize(dir)
+    with instrument.stage("archive"):
+        archive(dir)
+    with instrument.stage("next_cycle"):
+        nextCycle(dir)
+
+def _advance_worker(dir: str, instrumented: bool) -> dict:
+    """
+    advance inside a pool worker, returns the stage timings and counters of this task for the parent to merge
+    """
+    instrument.enabled = instrumented
+    instrument.reset()
+    advance(dir)
+    return instrument.report()
+
+
+class Scheduler:
+    """
+    Tracks the state of every calculation directory below root and advances the converged ones
+
+    The state of each directory is kept in a json file in root. A re-scan only inspects directories whose
+    modification time changed since the last pass (creating or removing a marker file updates it), and
+    converged calculations are advanced concurrently on a bounded process pool.
+    """
+
+    state_file = ".autodft_state.json"
+
+    def __init__(self, root: str = ".", max_workers: int = 4) -> None:
+
+        self.root = root
+        self.max_workers = max_workers
+        self.path = os.path.join(root, self.state_file)
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fh:
+                self.records = json.load(fh)
+
+    def scan(self) -> list[str]:
+        """
+        Updates the records of new and changed directories, returns the directories that are ready to advance
+        """
+        seen = set()
+        inspected = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            seen.add(entry.name)
+
+            mtime = entry.stat().st_mtime_ns
+            record = self.records.get(entry.name)
+            if record is not None and record["mtime"] == mtime:
+                continue #nothing was created or removed since the last pass
+
+            state = calculationState(entry.path)
+            inspected += 1
+            advanced = record is not None and record["state"] == state and record.get("advanced", False)
+            self.records[entry.name] = {"mtime": mtime, "state": state, "advanced": advanced, "error": None}
+
+        for name in set(self.records) - seen:
+            del self.records[name]
+        instrument.count("directories_seen", len(seen))
+        instrument.count("directories_inspected", inspected)
+
+        return sorted(name for name, record in self.records.items() if record["state"] == "GEO_OPT_CONVERGED" and not record["advanced"] and not record["error"])
+
+    def advance(self, names: list[str]):
+        """
+        Advances the given directories on the worker pool, failures are recorded instead of raised
+        """
+        if not names:
+            return
+
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(_advance_worker, os.path.join(self.root, name), instrument.enabled): name for name in names}
+            for future in as_completed(futures):
+                record = self.records[futures[future]]
+                try:
+                    instrument.merge(future.result()) #worker timings would otherwise stay in the worker process
+                    record["advanced"] = True
+                except Exception as error:
+                    record["error"] = f"{type(error).__name__}: {error}"
+                #advancing writes into the directory, remember the new mtime so it is not inspected again
+                record["mtime"] = os.stat(os.path.join(self.root, futures[future])).st_mtime_ns
+
+    def save(self):
+        """
+        Writes the records atomically
+        """
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.records, fh, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def counts(self) -> dict:
+        """
+        Number of directories in each state
+        """
+        counts = {}
+        for record in self.records.values():
+            counts[record["state"]] = counts.get(record["state"], 0) + 1
+        return counts
+
+    def run(self) -> dict:
+        """
+        One incremental pass: scan, advance and save
+        """
+        with instrument.stage("scan"):
+            ready = self.scan()
+        with instrument.stage("advance"):
+            self.advance(ready)
+        self.save()
+        return self.counts()
+
+
+def autoSubmit(dir: str=".", max_workers: int = 4):
+    """
+    Checks each directory to see if a calculation has been completeed, and if so, creates a new directory run the next job
+    """
+    counts = Scheduler(dir, int(max_workers)).run()
+    for state, count in sorted(counts.items(), key=str):
+        print(f"{state}: {count}")
         
 
 #Allows you to call function in terminal 
 if __name__ == '__main__':
-    globals()[sys.argv[1]]()
+    globals()[sys.argv[1]](*sys.argv[2:])
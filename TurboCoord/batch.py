@@ -0,0 +1,135 @@
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from . import hostcache
+from .TurboCoord import Ligand, screenHost
+
+
+_COMMENT = re.compile(r'(^|\s)#.*')
+
+def read_manifest(manifest: str) -> list[tuple[str, str]]:
+    """
+    Reads a manifest of host/ligand xyz pairs, one whitespace separated pair per line
+    Blank lines are skipped and '#' starts a comment at the start of a line or after whitespace, so paths may contain '#'
+    Relative paths are taken relative to the manifest
+    """
+    root = os.path.dirname(os.path.abspath(manifest))
+    pairs = []
+    with open(manifest, 'r') as f:
+        for line in f:
+            line = _COMMENT.sub('', line).split()
+            if not line:
+                continue
+            if len(line) != 2:
+                raise ValueError(f"Expected 'host.xyz ligand.xyz' in {manifest}, got {' '.join(line)}")
+            host, ligand = (os.path.join(root, path) for path in line)
+            pairs.append((host, ligand))
+    return pairs
+
+
+class SharedHosts:
+    """
+    Packs the coordinates of every host into a single shared memory block
+    Workers attach to the block once and slice their host out of it, so coordinates are never pickled per task
+    """
+
+    def __init__(self, xyzfiles) -> None:
+
+        self.xyzfiles = list(dict.fromkeys(xyzfiles)) #unique, in manifest order
+        hosts = [hostcache.load(xyzfile) for xyzfile in self.xyzfiles] #parsed once per host file, see hostcache.py
+        coords = [host.coords for host in hosts]
+
+        #what a worker needs besides the coordinates to attach to the host cache (see hostcache.attach), sent once per worker
+        self.headers = {xyzfile: (host.key, host.numbers, host.frozen) for xyzfile, host in zip(self.xyzfiles, hosts)}
+        self.slices = {}
+        start = 0
+        for xyzfile, host in zip(self.xyzfiles, coords):
+            self.slices[xyzfile] = (start, start + len(host))
+            start += len(host)
+        self.n_atoms = start
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(self.n_atoms * 3 * 8, 1))
+        self.coords = np.ndarray((self.n_atoms, 3), dtype=float, buffer=self.shm.buf)
+        if coords:
+            self.coords[:] = np.concatenate(coords)
+
+    def close(self):
+        del self.coords #release the view before the buffer
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#per-process state filled in by the pool initializer
+_worker = {}
+
+def _attach(name: str, n_atoms: int, headers: dict):
+    """
+    Pool initializer, maps the shared host block into the worker process
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    _worker['shm'] = shm
+    _worker['coords'] = np.ndarray((n_atoms, 3), dtype=float, buffer=shm.buf)
+    _worker['headers'] = headers
+    _worker['ligands'] = {}
+    _worker['hosts'] = {}
+
+def _screen(host: str, ligand_xyzfile: str, start: int, stop: int, options: dict) -> dict:
+    """
+    Screens one host/ligand pair inside a worker
+    """
+    hosts = _worker['hosts']
+    if host not in hosts:
+        #a view into shared memory, nothing is copied, the tree and the clearances are then built at most once per worker
+        key, numbers, frozen = _worker['headers'][host]
+        hosts[host] = hostcache.attach(key, numbers, _worker['coords'][start:stop], frozen)
+    ligands = _worker['ligands']
+    if ligand_xyzfile not in ligands:
+        ligands[ligand_xyzfile] = Ligand(ligand_xyzfile) #each worker parses a ligand only once
+    
+    sites, placements = screenHost(hosts[host].coords, ligands[ligand_xyzfile], host=hosts[host], **options)
+
+    return {'host': host, 'ligand': ligand_xyzfile, 'sites': sites, 'ligand_coords': placements}
+
+
+def screenLibrary(pairs, max_workers: int = None, **options):
+    """
+    Screens many host/ligand pairs on a process pool
+    pairs is a list of (host xyz, ligand xyz) tuples, such as the output of read_manifest
+    options are passed on to TurboCoord.screenHost (n_points, cutoff, clash_cutoff, radii, refine_samples)
+    Yields one result dict (host, ligand, sites, ligand_coords) per pair as soon as it finishes, in completion order
+    """
+    pairs = list(pairs)
+
+    with SharedHosts(host for host, _ in pairs) as hosts:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach, initargs=(hosts.shm.name, hosts.n_atoms, hosts.headers)) as pool:
+            futures = [pool.submit(_screen, host, ligand, *hosts.slices[host], options) for host, ligand in pairs]
+            for future in as_completed(futures):
+                yield future.result()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Screen every host/ligand pair of a manifest in parallel")
+    parser.add_argument("manifest", help="file with one 'host.xyz ligand.xyz' pair per line")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes (default: all cores)")
+    parser.add_argument("-n", "--n-points", type=int, default=100, help="points on the sampling sphere")
+    parser.add_argument("-c", "--cutoff", type=float, default=1.5, help="minimum distance between a site and the host")
+    args = parser.parse_args(argv)
+
+    pairs = read_manifest(args.manifest)
+    for result in screenLibrary(pairs, args.workers, n_points=args.n_points, cutoff=args.cutoff):
+        print(f"{result['host']} {result['ligand']} {len(result['sites'])}", flush=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,155 @@
+from collections import namedtuple
+import numpy as np
+from scipy import ndimage
+from . import elements
+from . import spatialTools as st
+
+
+Pocket = namedtuple('Pocket', ['centroid', 'volume', 'direction', 'clearance', 'point'])
+Pocket.__doc__ = """
+An empty, connected region of the first coordination sphere
+
+centroid: np.ndarray
+    Mean position of the pocket voxels
+volume: float
+    Pocket volume in cubic Angstrom
+direction: np.ndarray
+    Unit vector from the central atom into the pocket (clearance weighted), the direction a ligand should come in from
+clearance: float
+    Largest distance from the pocket to the nearest van der Waals surface
+point: np.ndarray
+    The most open voxel of the pocket
+"""
+
+
+class CavityMap:
+    """
+    Voxel map of the empty space around the central atom
+
+    Every voxel stores its clearance, the distance to the nearest van der Waals surface of the host (negative inside an atom).
+    Atom centres are stamped into the grid and a Euclidean distance transform per element radius finds the nearest atom of every
+    voxel, so building the map costs a few array passes regardless of how many atoms the host has.
+    The central atom (the first atom, at the origin) is left out, since the pockets are the gaps around it.
+    """
+
+    def __init__(self, numbers, coords, spacing: float = 0.25, r_max: float = 5.0, exclude_center: bool = True) -> None:
+
+        numbers = np.asarray(numbers)
+        coords = np.asarray(coords, dtype=float)
+        if exclude_center:
+            numbers, coords = numbers[1:], coords[1:]
+        radii = elements.VDW_RADII[numbers]
+
+        self.spacing = spacing
+        self.r_max = r_max
+        #pad the box so atoms whose surface reaches into it still have their centre on the grid
+        self.half_width = r_max + (radii.max() if len(radii) else 0.0)
+        n = int(np.ceil(2 * self.half_width / spacing)) + 1
+        self.shape = (n, n, n)
+        self.origin = np.full(3, -self.half_width)
+
+        self.clearance = np.full(self.shape, np.inf)
+        inside = np.all(np.abs(coords) <= self.half_width, axis=1)
+        for radius in np.unique(radii[inside]):
+            group = coords[inside & (radii == radius)]
+            index = np.round((group - self.origin) / spacing).astype(int)
+
+            #atoms that round to the same voxel would overwrite each other in one stamp, so the k-th atom of every voxel goes into the k-th stamp
+            flat = np.ravel_multi_index(tuple(index.T), self.shape)
+            order = np.argsort(flat, kind='stable')
+            starts = np.flatnonzero(np.r_[True, np.diff(flat[order]) != 0])
+            rank = np.empty(len(flat), dtype=int)
+            rank[order] = np.arange(len(flat)) - np.repeat(starts, np.diff(np.r_[starts, len(flat)]))
+            for layer in range(rank.max() + 1):
+                self._stamp(group[rank == layer], index[rank == layer], radius)
+
+    def _stamp(self, group, index, radius: float) -> None:
+        """
+        Lowers the clearance of every voxel to its distance from the surface of the nearest atom of group (one atom per voxel)
+        """
+        centres = np.ones(self.shape, dtype=bool)
+        centres[tuple(index.T)] = False
+        owner = np.full(self.shape, -1)
+        owner[tuple(index.T)] = np.arange(len(group))
+
+        #nearest atom centre of every voxel, then the exact distance to that atom's surface
+        nearest = ndimage.distance_transform_edt(centres, return_distances=False, return_indices=True)
+        atom = owner[tuple(nearest)]
+        distance = np.linalg.norm(self.voxels() - group[atom], axis=-1) - radius
+        np.minimum(self.clearance, distance, out=self.clearance)
+
+    def voxels(self) -> np.ndarray:
+        """
+        Coordinates of every voxel centre, shape (*self.shape, 3)
+        """
+        axis = self.origin[0] + self.spacing * np.arange(self.shape[0])
+        return np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1)
+
+    def pockets(self, r_in: float = 2.0, r_out: float = 4.0, probe: float = 0.0, min_volume: float = 0.5) -> list[Pocket]:
+        """
+        Labels the connected empty regions of the shell r_in <= r <= r_out around the central atom
+        A voxel is empty when its clearance is at least probe, pockets smaller than min_volume are dropped
+        Returns the pockets sorted by volume, largest first
+        """
+        if r_out > self.r_max:
+            raise ValueError(f"The shell reaches {r_out} but the map only extends to {self.r_max}, build it with a larger r_max")
+
+        voxels = self.voxels()
+        r = np.linalg.norm(voxels, axis=-1)
+        #voxels with no atom in reach (e.g. around a bare central atom) count as r_out away from any surface
+        clearance_map = np.minimum(self.clearance, r_out)
+        empty = (clearance_map >= probe) & (r >= r_in) & (r <= r_out)
+
+        labels, n_labels = ndimage.label(empty, structure=ndimage.generate_binary_structure(3, 3))
+        if n_labels == 0:
+            return []
+
+        flat = labels.ravel()
+        mask = flat > 0
+        label = flat[mask] - 1
+        points = voxels.reshape(-1, 3)[mask]
+        clearance = clearance_map.ravel()[mask]
+        units = points / r.ravel()[mask][:, None]
+
+        #most open voxel of every pocket
+        order = np.lexsort((clearance, label))
+        last = np.r_[np.nonzero(np.diff(label[order]))[0], len(order) - 1]
+        best = order[last]
+
+        counts = np.bincount(label, minlength=n_labels)
+        centroids = np.stack([np.bincount(label, points[:, k], n_labels) for k in range(3)], axis=1) / counts[:, None]
+        weights = clearance - probe + self.spacing #every voxel counts, the more open ones more
+        directions = np.stack([np.bincount(label, units[:, k] * weights, n_labels) for k in range(3)], axis=1)
+        norms = np.linalg.norm(directions, axis=1)
+        #a pocket that wraps around the central atom has (almost) no net opening, it is entered through its most open voxel
+        closed = norms <= 0.1 * np.bincount(label, weights, n_labels)
+        directions[closed] = units[best[closed]]
+        norms[closed] = 1.0
+        directions /= norms[:, None]
+
+        pockets = [Pocket(centroids[i], counts[i] * self.spacing ** 3, directions[i], clearance[best[i]], points[best[i]]) for i in range(n_labels)]
+        pockets = [pocket for pocket in pockets if pocket.volume >= min_volume]
+        return sorted(pockets, key=lambda pocket: pocket.volume, reverse=True)
+
+
+def pocketSites(pockets: list[Pocket], radius: float = 2.5, tree=None) -> np.ndarray:
+    """
+    Turns pockets into placement sites (spatialTools.SITE_DTYPE) at radius along each opening direction
+    The shell field holds the pocket index, clearance is the distance to the nearest atom centre when a spatial index is given
+    """
+    sites = np.zeros(len(pockets), dtype=st.SITE_DTYPE)
+    if not pockets:
+        return sites
+    sites['point'] = radius * np.array([pocket.direction for pocket in pockets])
+    sites['radius'] = radius
+    sites['shell'] = np.arange(len(pockets))
+    sites['clearance'] = st.clearance(sites['point'], tree) if tree is not None else [pocket.clearance for pocket in pockets]
+    return sites
+
+def searchPockets(numbers, coords, radius: float = 2.5, r_in: float = 2.0, r_out: float = 4.0, probe: float = 0.0, spacing: float = 0.25, tree=None) -> np.ndarray:
+    """
+    Placement sites (spatialTools.SITE_DTYPE) on the openings of a host, the cavity counterpart of spatialTools.searchSites
+    One site per pocket of the shell r_in <= r <= r_out (see CavityMap.pockets), at radius along its opening direction
+    """
+    pockets = CavityMap(numbers, coords, spacing, r_max=r_out).pockets(r_in, r_out, probe)
+    return pocketSites(pockets, radius, tree)
@@ -1,6 +1,6 @@
 import numpy as np
-import spatialTools as st
-from TurboCoord import Atom, Ligand, CoordinationComplex
+from . import spatialTools as st
+from .TurboCoord import Atom, Ligand, LigandGroup, CoordinationComplex
 
 
 
@@ -12,17 +12,88 @@ def dipole(Ligand):
     return dipole
 
 
-def molecular_mechanics(Ligand):
+def relax_placements(placed, tree, host_coords, pivots, r_rep: float = 2.0, k_rep: float = 1.0, k_tether: float = 1.0,
+                     steps: int = 200, step_size: float = 0.1, max_neighbours: int = 16, tolerance: float = 1e-3):
     """
-    Slightly displace or rotate the ligand if it is too close to an atom in the complex
+    Rigid-body relaxation of a batch of placed ligands against the host
+
+    Every ligand keeps its internal geometry and only moves through its six rigid-body degrees of freedom:
+    a translation of its pivot (the donor atom on the sampled site) and a rotation about that pivot. The potential is
+        E = k_rep * sum over host - ligand pairs closer than r_rep of (r_rep - d)**2 + k_tether * |pivot - site|**2
+    with analytic forces and torques. Host neighbours come from a KD-tree query of all ligand atoms of the batch at once.
+
+    placed: (S, n, 3) ligand coordinates, pivots: (S, 3) sites the ligands were placed on
+    Returns the relaxed coordinates, the relaxed pivots and the minimum host distance of every ligand
     """
-    for atom in Ligand.Atoms:
-        for atom2 in Ligand.Atoms:
-            if atom != atom2:
-                if np.linalg.norm(atom.coords - atom2.coords) < 0.5:
-                    atom.coords += np.random.rand(3) * 0.1
-                    atom.coords = st.rotate(atom.coords, np.random.rand() * 0.1, np.random.rand(3))
-    return Ligand
+    coords = np.array(placed, dtype=float)
+    sites = np.asarray(pivots, dtype=float).reshape(-1, 3)
+    pivots = sites.copy()
+    host_coords = np.asarray(host_coords, dtype=float)
+    n_structures, n_atoms, _ = coords.shape
+    padded_host = np.vstack((host_coords, np.zeros(3))) #missing neighbours point at this extra row
+
+    moving = np.arange(n_structures) #ligands that have settled are dropped from the batch
+    for _ in range(steps):
+        if not len(moving):
+            break
+        current, pivot, site = coords[moving], pivots[moving], sites[moving]
+        distances, neighbours = tree.query(current.reshape(-1, 3), k=max_neighbours, distance_upper_bound=r_rep)
+        distances = distances.reshape(len(moving), n_atoms, max_neighbours)
+        neighbours = neighbours.reshape(len(moving), n_atoms, max_neighbours)
+        contact = np.isfinite(distances)
+
+        #force on every ligand atom, pushing it away from each host atom inside r_rep
+        separation = current[:, :, None, :] - padded_host[neighbours]
+        d = np.where(contact, distances, 1.0)
+        magnitude = np.where(contact, 2 * k_rep * (r_rep - d) / d, 0.0)
+        forces = (magnitude[..., None] * separation).sum(axis=2) #(S, n, 3)
+
+        arms = current - pivot[:, None, :]
+        force = forces.sum(axis=1) - 2 * k_tether * (pivot - site)
+        torque = np.cross(arms, forces).sum(axis=1)
+        inertia = (arms ** 2).sum(axis=(1, 2)) + 1e-12
 
+        settled = ~contact.any(axis=(1, 2)) | (np.maximum(np.abs(force).max(axis=1), np.abs(torque).max(axis=1)) < tolerance)
+        if settled.any():
+            keep = ~settled
+            moving, current, pivot, arms = moving[keep], current[keep], pivot[keep], arms[keep]
+            force, torque, inertia = force[keep], torque[keep], inertia[keep]
 
+        #gradient step on the rigid-body coordinates, capped so that no step moves an atom by much more than step_size
+        shift = step_size * force / n_atoms
+        shift *= np.minimum(1.0, step_size / (np.linalg.norm(shift, axis=1) + 1e-12))[:, None]
+        rotation = step_size * torque / inertia[:, None]
+        angles = np.minimum(np.linalg.norm(rotation, axis=1), step_size / np.sqrt(inertia / n_atoms))
+
+        #Rodrigues rotation of the arms about the pivots, one axis per structure
+        axes = rotation / np.maximum(np.linalg.norm(rotation, axis=1), 1e-12)[:, None]
+        cos, sin = np.cos(angles)[:, None, None], np.sin(angles)[:, None, None]
+        axes = axes[:, None, :]
+        arms = (arms * cos + np.cross(axes, arms) * sin
+                + axes * (arms * axes).sum(axis=2, keepdims=True) * (1 - cos))
+        pivots[moving] = pivot + shift
+        coords[moving] = arms + pivots[moving][:, None, :]
+
+    return coords, pivots, st.clearance(coords.reshape(-1, 3), tree).reshape(n_structures, n_atoms).min(axis=1, initial=np.inf)
+
+
+def molecular_mechanics(structure: CoordinationComplex, **kwargs):
+    """
+    Slightly displace or rotate the ligand if it is too close to an atom in the complex
+    The ligand is relaxed as a rigid body against the host (see relax_placements), keyword arguments are passed on
+    Every ligand of a LigandGroup is relaxed as its own rigid body
+    """
+    ligand = structure.ligand
+    if isinstance(ligand, LigandGroup):
+        offsets, donors = ligand.offsets, ligand.donors
+    else:
+        offsets, donors = [0], [ligand.donor]
 
+    coords = np.array(structure.ligand_coords, dtype=float)
+    stops = list(offsets[1:]) + [len(coords)]
+    for start, stop, donor in zip(offsets, stops, donors):
+        pivot = coords[donor] #each ligand is placed with its donor on its sampled site
+        relaxed, _, _ = relax_placements(coords[None, start:stop], structure.tree, structure.coords, pivot[None], **kwargs)
+        coords[start:stop] = relaxed[0]
+    structure.ligand_coords = coords
+    return structure
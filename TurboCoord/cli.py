@@ -0,0 +1,169 @@
+import argparse
+import sys
+
+#Every subcommand imports what it needs when it runs, so `turbocoord status` never loads numpy, scipy or the TURBOMOLE tooling
+
+
+def sample_command(args):
+    """
+    Samples, places and clash-filters a ligand around a host, writing a candidate archive (.npz) or a multi-frame xyz
+    """
+    from . import elements
+    from . import hostcache
+    from . import xyzio
+    from .TurboCoord import Ligand, screenHost
+
+    host = hostcache.load(args.host)
+    ligand = Ligand(args.ligand)
+    sites = None
+    if args.pockets:
+        from . import cavity
+        sites = cavity.searchPockets(host.numbers, host.coords, radius=args.radii[0], probe=args.probe, tree=host.tree)
+    sites, placements = screenHost(host.coords, ligand, n_points=args.n_points, cutoff=args.cutoff, clash_cutoff=args.clash_cutoff,
+                                   radii=args.radii, refine_samples=args.refine, n_spins=args.spins, relax=args.relax, host=host, sites=sites)
+
+    host_atoms = elements.element_symbols(host.numbers)
+    if args.output.endswith(".npz"):
+        from .archive import ArchiveWriter
+        with ArchiveWriter(args.output, host_atoms, host.coords, ligand.atoms) as writer:
+            writer.add(sites, placements)
+    else:
+        import numpy as np
+        xyzio.write_xyz(args.output, ((host_atoms + ligand.atoms, np.concatenate((host.coords, coords)), f"structure {i}")
+                                      for i, coords in enumerate(placements)))
+    print(f"{len(sites)} structures written to {args.output}")
+
+def filter_command(args):
+    """
+    Keeps the candidates of an archive that clear the host by cutoff and, optionally, drops near-duplicates
+    """
+    import numpy as np
+    from . import spatialTools as st
+    from .archive import ArchiveWriter, CandidateArchive
+
+    archive = CandidateArchive(args.archive)
+    tree = st.spatial_index(archive.host_coords)
+    ligand_coords = np.asarray(archive.ligand_coords, dtype=float)
+
+    keep = np.flatnonzero(~st.clashes(ligand_coords, tree, args.cutoff))
+    if args.dedup:
+        from . import comparator
+        keep = keep[comparator.deduplicate(ligand_coords[keep], tree, args.dedup)]
+
+    with ArchiveWriter(args.output, archive.host_elements, archive.host_coords, archive.ligand_elements) as writer:
+        writer.add(archive.candidates[keep], archive.ligand_coords[keep])
+    print(f"{len(keep)} of {len(archive)} candidates written to {args.output}")
+
+def export_command(args):
+    """
+    Exports candidates of an archive as xyz files or TURBOMOLE coord directories
+    """
+    from .archive import CandidateArchive
+
+    archive = CandidateArchive(args.archive)
+    indices = args.indices if args.indices else range(len(archive))
+    archive.export(indices, args.directory, args.format)
+    print(f"{len(indices)} candidates exported to {args.directory}")
+
+def define_command(args):
+    """
+    Runs (or reuses a cached) define in every calculation directory
+    """
+    from . import autoDFT
+
+    for workdir in args.directories:
+        autoDFT.define(args.parameters, convert_xyz=args.xyz is not None, xyz_file=args.xyz or "*.xyz", workdir=workdir, cache=not args.no_cache)
+
+def status_command(args):
+    """
+    Prints the number of calculations in each state below root (see autoDFT.Scheduler), advancing converged ones with --advance
+    """
+    from . import autoDFT
+
+    scheduler = autoDFT.Scheduler(args.root, args.workers)
+    if args.advance:
+        counts = scheduler.run()
+    else:
+        scheduler.scan()
+        scheduler.save()
+        counts = scheduler.counts()
+
+    if args.json:
+        import json
+        print(json.dumps({str(state): count for state, count in counts.items()}, sort_keys=True))
+    else:
+        for state, count in sorted(counts.items(), key=str):
+            print(f"{state}: {count}")
+
+def harvest_command(args):
+    """
+    Collects the results of every calculation below root into a CSV or Parquet table
+    """
+    from . import harvest
+
+    records = harvest.harvest(args.root, args.output, args.workers)
+    print(f"{len(records)} calculations written to {args.output}")
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="turbocoord", description="Coordination sampling and TURBOMOLE job automation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    command = subparsers.add_parser("sample", help=sample_command.__doc__.strip())
+    command.add_argument("host", help="host xyz file, the central atom first")
+    command.add_argument("ligand", help="ligand xyz file")
+    command.add_argument("-o", "--output", default="candidates.npz", help="candidate archive (.npz) or multi-frame xyz file")
+    command.add_argument("-n", "--n-points", type=int, default=100, help="points on each sampling sphere")
+    command.add_argument("-c", "--cutoff", type=float, default=1.5, help="minimum distance between a site and the host")
+    command.add_argument("--clash-cutoff", type=float, default=None, help="minimum distance between the ligand and the host (default: cutoff)")
+    command.add_argument("--radii", type=float, nargs="+", default=[2.5], help="radii of the sampling spheres")
+    command.add_argument("--refine", type=int, default=0, help="points of the refinement cap around each open site")
+    command.add_argument("--spins", type=int, default=0, help="spins about the binding axis, the least hindered is kept")
+    command.add_argument("--relax", action="store_true", help="relax near-miss placements as rigid bodies")
+    command.add_argument("--pockets", action="store_true", help="place on the pocket openings of the cavity map (first radius) instead of sampling spheres")
+    command.add_argument("--probe", type=float, default=0.0, help="clearance a pocket voxel needs with --pockets")
+    command.set_defaults(func=sample_command)
+
+    command = subparsers.add_parser("filter", help=filter_command.__doc__.strip())
+    command.add_argument("archive", help="candidate archive written by sample")
+    command.add_argument("-o", "--output", default="filtered.npz", help="filtered candidate archive")
+    command.add_argument("-c", "--cutoff", type=float, default=1.5, help="minimum distance between the ligand and the host")
+    command.add_argument("--dedup", type=float, default=0.0, help="drop placements within this tolerance (Angstrom) of a kept one")
+    command.set_defaults(func=filter_command)
+
+    command = subparsers.add_parser("export", help=export_command.__doc__.strip())
+    command.add_argument("archive", help="candidate archive")
+    command.add_argument("directory", help="output directory")
+    command.add_argument("-f", "--format", choices=("xyz", "coord"), default="xyz", help="output format")
+    command.add_argument("-i", "--indices", type=int, nargs="+", default=None, help="candidates to export (default: all)")
+    command.set_defaults(func=export_command)
+
+    command = subparsers.add_parser("define", help=define_command.__doc__.strip())
+    command.add_argument("directories", nargs="*", default=["."], help="calculation directories")
+    command.add_argument("-p", "--parameters", default="parameters.yaml", help="define parameters, relative to each directory")
+    command.add_argument("--xyz", default=None, help="convert this xyz file (glob pattern) to coord first")
+    command.add_argument("--no-cache", action="store_true", help="always run the interactive define")
+    command.set_defaults(func=define_command)
+
+    command = subparsers.add_parser("status", help=status_command.__doc__.strip())
+    command.add_argument("root", nargs="?", default=".", help="directory holding the calculation directories")
+    command.add_argument("--advance", action="store_true", help="also advance the converged calculations")
+    command.add_argument("-j", "--workers", type=int, default=4, help="worker processes for --advance")
+    command.add_argument("--json", action="store_true", help="print the counts as json")
+    command.set_defaults(func=status_command)
+
+    command = subparsers.add_parser("harvest", help=harvest_command.__doc__.strip())
+    command.add_argument("root", nargs="?", default=".", help="directory holding the calculation directories")
+    command.add_argument("-o", "--output", default="results.csv", help="table to write (.csv or .parquet)")
+    command.add_argument("-j", "--workers", type=int, default=16, help="reader threads")
+    command.set_defaults(func=harvest_command)
+
+    return parser
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
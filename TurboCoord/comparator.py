@@ -1,34 +1,46 @@
-import networkx as nx
-import matplotlib.pyplot as plt
-import networkx.algorithms.isomorphism as iso
 import itertools
+from collections import deque
 from itertools import permutations
 import os
-from TurboCoord import CoordinationComplex, generateStructures
+import numpy as np
+from scipy.sparse import csr_matrix
+from . import elements
+from .spatialTools import perceive_bonds
+from .TurboCoord import CoordinationComplex, generateStructures
+
+def adjacency(numbers, coords, tolerance: float = 0.45) -> csr_matrix:
+    """
+    Sparse (CSR) symmetric adjacency matrix of the bonds found by perceive_bonds
+    """
+    edges = perceive_bonds(numbers, coords, tolerance)
+    n_atoms = len(coords)
+    rows = np.concatenate((edges[:, 0], edges[:, 1]))
+    cols = np.concatenate((edges[:, 1], edges[:, 0]))
+    return csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n_atoms, n_atoms))
+
 
 class MolecularGraph:
     """
     Represent the xyz coordinates of a molecule in terms of a graph using networkx
+    Nodes are atom indices carrying their element, edges are the bonds found by perceive_bonds
     """
 
-    def __init__(self, CoordinationComplex):
-        super().__init__(CoordinationComplex)
+    def __init__(self, CoordinationComplex, tolerance: float = 0.45):
+        self.complex_atoms = CoordinationComplex.complex_atoms
+        self.complex_coords = CoordinationComplex.complex_coords
+        self.numbers = elements.atomic_numbers(self.complex_atoms)
+        self.tolerance = tolerance
+
+        import networkx as nx
         self.graph = nx.Graph()
-        self.graph.add_nodes_from(self.complex_atoms)
-        self.graph.add_edges_from(self.get_edges())
-        self.graph = self.graph.to_undirected()
-        self.graph = nx.convert_node_labels_to_integers(self.graph, first_label=0, ordering='default', label_attribute=None)
+        self.graph.add_nodes_from((i, {'element': element}) for i, element in enumerate(self.complex_atoms))
+        self.graph.add_edges_from(self.get_edges().tolist())
 
     def get_edges(self):
         """
         Get the edges of the graph
         """
-        edges = []
-        for i in range(len(self.complex_atoms)):
-            for j in range(len(self.complex_atoms)):
-                if self.distance_matrix[i][j] < 2.0:
-                    edges.append((self.complex_atoms[i], self.complex_atoms[j]))
-        return edges
+        return perceive_bonds(self.numbers, self.complex_coords, self.tolerance)
 
     def get_graph(self):
         return self.graph
@@ -37,6 +49,167 @@ class MolecularGraph:
         """
         Get the isomorphisms between two graphs
         """
-        GM = iso.GraphMatcher(self.graph, other.graph)
+        import networkx.algorithms.isomorphism as iso
+        GM = iso.GraphMatcher(self.graph, other.graph, node_match=iso.categorical_node_match('element', None))
         return GM.is_isomorphic()
-    
+
+    def hash(self, iterations: int = 3) -> str:
+        """
+        Weisfeiler-Lehman hash of the graph with element labels, equal for isomorphic graphs
+        """
+        import networkx as nx
+        return nx.weisfeiler_lehman_graph_hash(self.graph, node_attr='element', iterations=iterations)
+
+
+def unique_graphs(graphs: list[MolecularGraph]) -> list[int]:
+    """
+    Indices of the pairwise non-isomorphic graphs
+    Graphs are bucketed by their Weisfeiler-Lehman hash and the exact isomorphism test only runs inside a bucket
+    """
+    buckets = {}
+    unique = []
+    for i, graph in enumerate(graphs):
+        bucket = buckets.setdefault(graph.hash(), [])
+        if any(graphs[j].get_isomorphisms(graph) for j in bucket):
+            continue
+        bucket.append(i)
+        unique.append(i)
+    return unique
+
+
+def placement_descriptors(ligand_coords, tree, k: int = 8) -> np.ndarray:
+    """
+    Describes each placed ligand by the distances from every ligand atom to its k nearest host atoms
+    The descriptor does not depend on how the host atoms are numbered, so symmetry related placements look alike
+    k is clamped to the number of host atoms, smaller hosts would otherwise pad the descriptor with inf
+    Returns an (S, n_ligand, k) array
+    """
+    ligand_coords = np.asarray(ligand_coords, dtype=float)
+    k = min(k, tree.n)
+    distances, _ = tree.query(ligand_coords.reshape(-1, 3), k=k)
+    return distances.reshape(*ligand_coords.shape[:2], k)
+
+def fingerprints(descriptors, cell: float, atoms) -> np.ndarray:
+    """
+    Cheap bucket keys for placements: the distance from each of the given ligand atoms to its nearest host atom, quantized to cells of size cell
+    Each of them moves by less than the largest descriptor difference, so placements closer than cell always land in neighbouring buckets
+    Returns an (S, len(atoms)) integer array
+    """
+    return np.floor(descriptors[:, atoms, 0] / cell).astype(int)
+
+
+class _Bucket:
+    """
+    Descriptors of the placements kept in one fingerprint bucket, oldest first, in one preallocated array
+    """
+
+    __slots__ = ('descriptors', 'start', 'stop')
+
+    def __init__(self, shape) -> None:
+        self.descriptors = np.empty((4,) + shape)
+        self.start = self.stop = 0
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def view(self) -> np.ndarray:
+        return self.descriptors[self.start:self.stop]
+
+    def append(self, descriptor) -> None:
+        if self.stop == len(self.descriptors):
+            #grow (or compact when the oldest were dropped) by copying the live rows to the front
+            held = self.view()
+            if len(held) * 2 > len(self.descriptors):
+                self.descriptors = np.empty((2 * len(self.descriptors),) + self.descriptors.shape[1:])
+            self.descriptors[:len(held)] = held
+            self.start, self.stop = 0, len(held)
+        self.descriptors[self.stop] = descriptor
+        self.stop += 1
+
+    def popleft(self) -> None:
+        self.start += 1
+
+
+class Deduplicator:
+    """
+    Streaming version of deduplicate
+    Placements are fed in batches and every batch is compared with all placements kept so far, so near-duplicates
+    are dropped across batches while only the descriptors of the kept placements are held in memory
+    Placements are bucketed by the nearest host distance of key_atoms ligand atoms (see fingerprints), the atoms whose
+    distance spreads most over the first batch, so that each bucket only holds placements of similar orientation
+    With max_kept only the descriptors of the max_kept most recently kept placements are held (the oldest are forgotten
+    first), which bounds the memory of long streams at the price of letting through duplicates of forgotten placements
+    """
+
+    def __init__(self, tree, tolerance: float = 0.1, k: int = 8, max_kept: int = None, key_atoms: int = 3) -> None:
+        self.tree = tree
+        self.tolerance = tolerance
+        self.k = k
+        self.max_kept = max_kept
+        self.key_atoms = key_atoms
+        self.atoms = None #ligand atoms of the fingerprint, chosen on the first batch
+        self.buckets = {} #fingerprint -> _Bucket of the kept placements
+        self.order = deque() #fingerprints of the held descriptors, oldest first
+
+    def add(self, ligand_coords) -> np.ndarray:
+        """
+        Returns the indices of the placements of this batch that are kept, in their original order
+        """
+        descriptors = placement_descriptors(ligand_coords, self.tree, self.k)
+        if len(descriptors) == 0:
+            return np.empty(0, dtype=int)
+        if self.atoms is None:
+            spread = descriptors[:, :, 0].std(axis=0)
+            self.atoms = np.sort(np.argsort(-spread, kind='stable')[:self.key_atoms])
+            self.neighbours = np.array(list(itertools.product((-1, 0, 1), repeat=len(self.atoms))))
+        keys = fingerprints(descriptors, self.tolerance, self.atoms)
+
+        kept = []
+        for i, key in enumerate(keys):
+            duplicate = False
+            for neighbour in map(tuple, (key + self.neighbours).tolist()):
+                bucket = self.buckets.get(neighbour)
+                if bucket is not None and len(bucket) and np.abs(bucket.view() - descriptors[i]).max(axis=(1, 2)).min() < self.tolerance:
+                    duplicate = True
+                    break
+            if duplicate:
+                continue
+
+            key = tuple(key.tolist())
+            if key not in self.buckets:
+                self.buckets[key] = _Bucket(descriptors.shape[1:])
+            self.buckets[key].append(descriptors[i])
+            self.order.append(key)
+            kept.append(i)
+            if self.max_kept is not None and len(self.order) > self.max_kept:
+                oldest = self.order.popleft()
+                self.buckets[oldest].popleft()
+                if not self.buckets[oldest]:
+                    del self.buckets[oldest]
+
+        return np.array(kept, dtype=int)
+
+def deduplicate(ligand_coords, tree, tolerance: float = 0.1, k: int = 8) -> np.ndarray:
+    """
+    Drops near-identical placements of one ligand around one host
+    Placements are bucketed by fingerprint and only compared (largest descriptor difference below tolerance, in Angstrom)
+    with the placements already kept in the same or a neighbouring bucket
+    Returns the indices of the placements that are kept, in their original order
+    """
+    return Deduplicator(tree, tolerance, k).add(ligand_coords)
+
+def deduplicateStructures(structures: list[CoordinationComplex], tolerance: float = 0.1) -> list[CoordinationComplex]:
+    """
+    Removes near-identical structures (see deduplicate) before they are sent to DFT
+    """
+    groups = {}
+    for i, structure in enumerate(structures):
+        groups.setdefault(id(structure.coords), []).append(i)
+
+    keep = np.zeros(len(structures), dtype=bool)
+    for indices in groups.values():
+        placed = np.stack([structures[i].ligand_coords for i in indices])
+        kept = deduplicate(placed, structures[indices[0]].tree, tolerance)
+        keep[np.asarray(indices)[kept]] = True
+
+    return [structure for structure, kept in zip(structures, keep) if kept]
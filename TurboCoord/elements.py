@@ -0,0 +1,61 @@
+import numpy as np
+
+
+#element symbols indexed by atomic number, 0 is reserved for dummy/unknown atoms
+SYMBOLS = (
+    'X', 'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne', 'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl',
+    'Ar', 'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As', 'Se',
+    'Br', 'Kr', 'Rb', 'Sr', 'Y', 'Zr', 'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn', 'Sb',
+    'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd', 'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er',
+    'Tm', 'Yb', 'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At',
+    'Rn', 'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md', 'No',
+    'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og',
+)
+
+NUMBERS = {symbol.lower(): number for number, symbol in enumerate(SYMBOLS)}
+
+
+#single-bond covalent radii in Angstrom indexed by atomic number (Cordero et al., Dalton Trans. 2008, 2832)
+#elements past Cm fall back to 1.50, dummy atoms have no radius
+COVALENT_RADII = np.full(len(SYMBOLS), 1.50)
+COVALENT_RADII[0] = 0.0
+COVALENT_RADII[1:97] = (
+    0.31, 0.28, 1.28, 0.96, 0.84, 0.76, 0.71, 0.66, 0.57, 0.58, 1.66, 1.41, 1.21, 1.11, 1.07, 1.05,
+    1.02, 1.06, 2.03, 1.76, 1.70, 1.60, 1.53, 1.39, 1.39, 1.32, 1.26, 1.24, 1.32, 1.22, 1.22, 1.20,
+    1.19, 1.20, 1.20, 1.16, 2.20, 1.95, 1.90, 1.75, 1.64, 1.54, 1.47, 1.46, 1.42, 1.39, 1.45, 1.44,
+    1.42, 1.39, 1.39, 1.38, 1.39, 1.40, 2.44, 2.15, 2.07, 2.04, 2.03, 2.01, 1.99, 1.98, 1.98, 1.96,
+    1.94, 1.92, 1.92, 1.89, 1.90, 1.87, 1.87, 1.75, 1.70, 1.62, 1.51, 1.44, 1.41, 1.36, 1.36, 1.32,
+    1.45, 1.46, 1.48, 1.40, 1.50, 1.50, 2.60, 2.21, 2.15, 2.06, 2.00, 1.96, 1.90, 1.87, 1.80, 1.69,
+)
+
+
+#van der Waals radii in Angstrom (Bondi, J. Phys. Chem. 1964, 68, 441), elements Bondi does not list fall back to 2.00
+_BONDI = {
+    'H': 1.20, 'He': 1.40, 'Li': 1.82, 'B': 1.92, 'C': 1.70, 'N': 1.55, 'O': 1.52, 'F': 1.47, 'Ne':
+    1.54, 'Na': 2.27, 'Mg': 1.73, 'Al': 1.84, 'Si': 2.10, 'P': 1.80, 'S': 1.80, 'Cl': 1.75, 'Ar': 1.88,
+    'K': 2.75, 'Ni': 1.63, 'Cu': 1.40, 'Zn': 1.39, 'Ga': 1.87, 'Ge': 2.11, 'As': 1.85, 'Se': 1.90, 'Br':
+    1.85, 'Kr': 2.02, 'Pd': 1.63, 'Ag': 1.72, 'Cd': 1.58, 'In': 1.93, 'Sn': 2.17, 'Sb': 2.06, 'Te':
+    2.06, 'I': 1.98, 'Xe': 2.16, 'Pt': 1.75, 'Au': 1.66, 'Hg': 1.55, 'Tl': 1.96, 'Pb': 2.02, 'U': 1.86,
+}
+VDW_RADII = np.full(len(SYMBOLS), 2.00)
+VDW_RADII[0] = 0.0
+for _symbol, _radius in _BONDI.items():
+    VDW_RADII[NUMBERS[_symbol.lower()]] = _radius
+
+
+def atomic_numbers(symbols) -> np.ndarray:
+    """
+    Converts element symbols (any capitalisation, e.g. 'Yb', 'YB' or 'yb') into an array of atomic numbers
+    'X' is the dummy atom (0), any other unknown symbol raises a ValueError instead of being silently lost on the way back
+    """
+    symbols = list(symbols)
+    unknown = sorted({symbol for symbol in symbols if symbol.lower() not in NUMBERS})
+    if unknown:
+        raise ValueError(f"Unknown element symbols {unknown}")
+    return np.array([NUMBERS[symbol.lower()] for symbol in symbols], dtype=np.int16)
+
+def element_symbols(numbers) -> list[str]:
+    """
+    Converts atomic numbers back into element symbols
+    """
+    return [SYMBOLS[number] for number in np.asarray(numbers).tolist()]
@@ -0,0 +1,128 @@
+import csv
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from .autoDFT import calculationState
+
+
+#job outputs searched for SCF iterations and timings, in order of preference
+OUTPUT_FILES = ("job.last", "ridft.out", "dscf.out")
+FIELDS = ("directory", "name", "state", "energy", "geo_cycles", "scf_iterations", "cpu_time", "wall_time", "energy_change")
+
+_SCF_ITERATIONS = re.compile(r"convergence criteria satisfied after\s+(\d+)\s+iterations")
+_CPU_TIME = re.compile(r"total\s+cpu-time\s*:\s*([^\n]*)")
+_WALL_TIME = re.compile(r"total\s+wall-time\s*:\s*([^\n]*)")
+_TIME_PART = re.compile(r"([\d.]+)\s*(day|hour|minute|second)")
+_ENERGY_CHANGE = re.compile(r"\$last SCF energy change\s*=\s*(\S+)")
+_SECONDS = {"day": 86400.0, "hour": 3600.0, "minute": 60.0, "second": 1.0}
+
+
+def tail_lines(filename: str, n_bytes: int = 4096) -> list[str]:
+    """
+    Returns the lines in the last n_bytes of a file without reading the rest of it
+    """
+    with open(filename, "rb") as fh:
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        fh.seek(max(size - n_bytes, 0))
+        lines = fh.read().decode(errors="replace").splitlines()
+    return lines[1:] if size > n_bytes else lines #the first line may be cut
+
+def read_energy(filename: str = "energy"):
+    """
+    Returns the last geometry cycle and its SCF energy (Hartree) from a TURBOMOLE energy file
+    """
+    for line in reversed(tail_lines(filename)):
+        words = line.split()
+        if len(words) >= 2 and not line.lstrip().startswith("$"):
+            return int(words[0]), float(words[1])
+    return None, None
+
+def parse_time(text: str) -> float:
+    """
+    Converts a TURBOMOLE duration such as '1 minutes and 23.4 seconds' into seconds
+    """
+    return sum(float(value) * _SECONDS[unit] for value, unit in _TIME_PART.findall(text))
+
+def read_output(filename: str) -> dict:
+    """
+    SCF iterations of the last SCF run and total cpu/wall time (seconds, summed over all programs) of a job output
+    """
+    with open(filename, "r", errors="replace") as fh:
+        text = fh.read()
+
+    iterations = _SCF_ITERATIONS.findall(text)
+    return {
+        "scf_iterations": int(iterations[-1]) if iterations else None,
+        "cpu_time": sum(parse_time(match) for match in _CPU_TIME.findall(text)) or None,
+        "wall_time": sum(parse_time(match) for match in _WALL_TIME.findall(text)) or None,
+    }
+
+def read_control(filename: str = "control") -> dict:
+    """
+    Reads the last SCF energy change written to control by jobex
+    """
+    with open(filename, "r") as fh:
+        match = _ENERGY_CHANGE.search(fh.read())
+    return {"energy_change": float(match.group(1)) if match else None}
+
+def read_record(dir: str = ".") -> dict:
+    """
+    Collects the results of one calculation directory into a flat record (see FIELDS), missing values are None
+    """
+    record = dict.fromkeys(FIELDS)
+    record["directory"] = os.path.abspath(dir)
+    record["name"] = os.path.basename(record["directory"])
+    record["state"] = calculationState(dir)
+
+    if os.path.exists(os.path.join(dir, "energy")):
+        record["geo_cycles"], record["energy"] = read_energy(os.path.join(dir, "energy"))
+    if os.path.exists(os.path.join(dir, "control")):
+        record.update(read_control(os.path.join(dir, "control")))
+    for filename in OUTPUT_FILES:
+        if os.path.exists(os.path.join(dir, filename)):
+            record.update(read_output(os.path.join(dir, filename)))
+            break
+
+    return record
+
+
+def calculationDirs(root: str = ".") -> list[str]:
+    """
+    Every directory below root that holds a TURBOMOLE calculation (a control file), archive copies excluded
+    """
+    dirs = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [dirname for dirname in dirnames if dirname != "archive"]
+        if "control" in filenames:
+            dirs.append(dirpath)
+    return sorted(dirs)
+
+def write_table(records: list[dict], filename: str):
+    """
+    Writes records as one table, Parquet when filename ends in .parquet (requires pyarrow) and CSV otherwise
+    """
+    if filename.endswith(".parquet"):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing .parquet tables requires pyarrow, use a .csv filename instead")
+        pq.write_table(pa.Table.from_pylist(records), filename)
+        return
+
+    with open(filename, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+
+def harvest(root: str = ".", filename: str = None, max_workers: int = 16) -> list[dict]:
+    """
+    Reads the results of every calculation below root in parallel, optionally writing them to a table (see write_table)
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        records = list(pool.map(read_record, calculationDirs(root)))
+
+    if filename is not None:
+        write_table(records, filename)
+    return records
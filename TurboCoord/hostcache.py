@@ -0,0 +1,306 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from . import elements
+from . import instrument
+from . import sampling
+from . import spatialTools as st
+from . import xyzio
+
+HOST_CACHE = os.environ.get("TURBOCOORD_HOST_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "turbocoord", "hosts"))
+#bytes the cache may hold, the least recently used hosts are removed beyond it (see prune)
+HOST_CACHE_SIZE = int(os.environ.get("TURBOCOORD_HOST_CACHE_SIZE", 1 << 30))
+
+#the arrays of the atoms.npz of a host, every cached clearance is a <name>.npy next to it
+_ATOMS = ('numbers', 'coords', 'frozen')
+
+
+class Memo(OrderedDict):
+    """
+    Least recently used objects of this process, at most maxsize of them
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+        return value
+
+_memo = Memo(32) #hosts already loaded by this process, keyed by content hash
+
+def hostKey(xyzfile: str) -> str:
+    """
+    Hash of the bytes of a host xyz file
+    Renaming or copying a host keeps its cache, editing a single coordinate invalidates it
+    """
+    digest = hashlib.sha256()
+    with open(xyzfile, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _readonly(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+class Host:
+    """
+    Per-host precomputation shared by every screen of the same host file
+
+    numbers, coords and frozen are the parsed atoms (first atom at the origin) and are read-only
+    The clearances of the coarse spheres (distance of every sampled point to its nearest host atom) do not depend on the cutoff
+    or the ligand, so they are computed once per (samples, radius) and kept on disk next to the atoms, one file per sphere
+    Changing the cutoff or the ligand is then only a filter over the cached clearances, refinement caps are only laid
+    around the open points of that filter and are not cached
+    """
+
+    def __init__(self, key: str, numbers, coords, frozen, directory=None) -> None:
+        self.key = key
+        self.numbers = _readonly(numbers)
+        self.coords = _readonly(coords)
+        self.frozen = _readonly(frozen)
+        self.arrays = {} #clearances read or computed by this process, by name
+        self.directory = directory
+        self._tree = None
+
+    @property
+    def tree(self):
+        """
+        Spatial index of the host, built at most once per process
+        """
+        if self._tree is None:
+            self._tree = st.spatial_index(self.coords)
+        return self._tree
+
+    def _cached(self, name: str, compute) -> np.ndarray:
+        array = self.arrays.get(name)
+        if array is None and self.directory is not None:
+            array = _read_array(os.path.join(self.directory, name + ".npy"))
+        if array is None:
+            instrument.count("host_cache_misses")
+            array = compute()
+            self._store(name + ".npy", lambda f: np.save(f, array))
+        else:
+            instrument.count("host_cache_hits")
+        self.arrays[name] = _readonly(array)
+        return array
+
+    def sphere(self, samples: int, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Points of a Fibonacci sphere of the given radius and the clearance of every point
+        """
+        points = radius * st.fibonacci_sphere(samples)
+        return points, self._cached(f"sphere_{samples}_{radius:g}", lambda: st.clearance(points, self.tree))
+
+    def sphere_slices(self, samples: int, radius: float, batch_size: int = 1024):
+        """
+        The points and clearances of sphere(samples, radius), batch_size points at a time, so neither is ever whole in memory
+        Cached clearances are read from their memory-mapped file a slice at a time, missing ones are computed a slice at a time
+        and written into a new cache file as they go
+        """
+        name = f"sphere_{samples}_{radius:g}"
+        clearance = self.arrays.get(name)
+        if clearance is None and self.directory is not None:
+            clearance = _read_array(os.path.join(self.directory, name + ".npy"))
+        if clearance is not None:
+            instrument.count("host_cache_hits")
+            self.arrays[name] = _readonly(clearance)
+            for start in range(0, samples, batch_size):
+                yield radius * sampling.fibonacci(samples, start, start + batch_size), np.asarray(clearance[start:start + batch_size])
+            return
+
+        instrument.count("host_cache_misses")
+        staging, stored = None, None
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                fd, staging = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                os.close(fd)
+                stored = np.lib.format.open_memmap(staging, mode='w+', dtype=float, shape=(samples,))
+            except OSError: #not writable, compute without keeping the clearances
+                instrument.count("host_cache_write_errors")
+                if staging is not None and os.path.exists(staging):
+                    os.unlink(staging)
+
+        completed = False
+        try:
+            for start in range(0, samples, batch_size):
+                points = radius * sampling.fibonacci(samples, start, start + batch_size)
+                clearance = st.clearance(points, self.tree)
+                if stored is not None:
+                    stored[start:start + len(points)] = clearance
+                yield points, clearance
+            completed = True
+        finally:
+            if stored is not None:
+                stored.flush()
+                del stored
+                try:
+                    if completed:
+                        os.replace(staging, os.path.join(self.directory, name + ".npy"))
+                        prune(keep=self.directory)
+                    else: #abandoned half way, the partial file is of no use
+                        os.unlink(staging)
+                except OSError:
+                    instrument.count("host_cache_write_errors")
+
+    def validPoints(self, samples: int, cutoff: float, radius: float = 2.5) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same as spatialTools.validPoints on a sphere of the host, but from the cached clearances
+        """
+        points, clearance = self.sphere(samples, radius)
+        mask = clearance > cutoff
+        return points[mask], points[~mask]
+
+    def searchSites(self, radii=(2.3, 2.5, 2.7), samples: int = 100, cutoff: float = 1.5, refine_samples: int = 50) -> np.ndarray:
+        """
+        Same sites as spatialTools.searchSites, but with the coarse clearances from the cache
+        """
+        sites = []
+        for shell, radius in enumerate(radii):
+            coarse, coarse_clearance = self.sphere(samples, radius)
+            sites.append(st.shell_sites(coarse[coarse_clearance > cutoff], radius, shell, self.tree, cutoff, samples, refine_samples))
+        return np.concatenate(sites) if sites else np.empty(0, dtype=st.SITE_DTYPE)
+
+    def save(self) -> None:
+        """
+        Writes the atoms of the host to its cache directory
+        """
+        self._store("atoms.npz", lambda f: np.savez(f, numbers=self.numbers, coords=self.coords, frozen=self.frozen))
+
+    def _store(self, filename: str, write) -> None:
+        """
+        Writes one file of the cache directory through write(f), replacing it atomically, then trims the cache (see prune)
+        The cache is best-effort: when the cache directory cannot be written the host simply stays in memory
+        """
+        if self.directory is None:
+            return
+        staging = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, staging = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(staging, os.path.join(self.directory, filename))
+        except OSError:
+            instrument.count("host_cache_write_errors")
+            if staging is not None and os.path.exists(staging):
+                os.unlink(staging)
+            return
+        prune(keep=self.directory)
+
+
+def load(xyzfile: str, cache: bool = True) -> Host:
+    """
+    Returns the Host of an xyz file, from this process, from the on-disk cache (see HOST_CACHE) or by parsing the file
+    With cache False the file is always parsed and nothing is kept or written
+    """
+    if not cache:
+        return _parse(None, xyzfile, None)
+    key = hostKey(xyzfile)
+    host = _memo.get(key)
+    if host is not None:
+        return host
+
+    directory = os.path.join(HOST_CACHE, key)
+    with instrument.stage("host_cache"):
+        atoms = _read(os.path.join(directory, "atoms.npz"))
+        if atoms is not None and all(name in atoms for name in _ATOMS):
+            host = Host(key, atoms['numbers'], atoms['coords'], atoms['frozen'], directory)
+            _touch(directory)
+        else:
+            host = _parse(key, xyzfile, directory)
+            host.save()
+    return _memo.put(key, host)
+
+def attach(key: str, numbers, coords, frozen) -> Host:
+    """
+    Host over atoms that are already in memory, e.g. the shared memory block of batch.SharedHosts
+    key is the hostKey of the host file, its clearances are read from and written to the same cache directory as load
+    """
+    return Host(key, numbers, coords, frozen, os.path.join(HOST_CACHE, key))
+
+def prune(keep: str = None) -> None:
+    """
+    Removes the least recently used hosts (oldest modification time) from HOST_CACHE until it holds at most HOST_CACHE_SIZE bytes
+    keep, the directory just written, is never removed
+    """
+    try:
+        entries = list(os.scandir(HOST_CACHE))
+    except OSError:
+        return
+    usage = []
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                size = sum(item.stat().st_size for item in os.scandir(entry.path) if item.is_file())
+            else:
+                size = entry.stat().st_size
+            usage.append((entry.stat().st_mtime, size, entry))
+        except OSError: #removed by another process meanwhile
+            continue
+
+    total = sum(size for _, size, _ in usage)
+    for _, size, entry in sorted(usage, key=lambda item: item[0]):
+        if total <= HOST_CACHE_SIZE:
+            break
+        if entry.path == keep:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            with contextlib.suppress(OSError):
+                os.unlink(entry.path)
+        total -= size
+        instrument.count("host_cache_evictions")
+
+def _touch(directory: str) -> None:
+    #marks a host as recently used for prune
+    with contextlib.suppress(OSError):
+        os.utime(directory)
+
+def _read(path: str):
+    """
+    Arrays of an npz file, None when there is no readable one
+    """
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError):
+        return None
+
+def _read_array(path: str):
+    """
+    The array of an npy file, memory-mapped read-only, None when there is no readable one
+    """
+    try:
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+def _parse(key: str, xyzfile: str, directory) -> Host:
+    frame = xyzio.read_xyz(xyzfile)
+    frozen = np.zeros(len(frame.coords), dtype=bool) if frame.frozen is None else np.asarray(frame.frozen, dtype=bool)
+    return Host(key, elements.atomic_numbers(frame.elements), st.set_origin(frame.coords), frozen, directory)
+
+def clear() -> None:
+    """
+    Forgets the hosts loaded by this process, the on-disk cache is kept
+    """
+    _memo.clear()
@@ -0,0 +1,133 @@
+import atexit
+import contextlib
+import json
+import os
+import sys
+import time
+
+
+#instrumentation is switched on for the whole process with TURBOCOORD_PROFILE (a path for the json report, or 1 for stderr)
+#or around a block with run(), TURBOCOORD_PROFILE_WITH="profile,memory" adds the profilers of run() to the process-wide report
+enabled = False
+_timings = {}
+_counters = {}
+_null = contextlib.nullcontext()
+
+
+class _Stage:
+    """
+    Times one pass through a stage and adds it to the running totals
+    """
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        total, calls = _timings.get(self.name, (0.0, 0))
+        _timings[self.name] = (total + time.perf_counter() - self.start, calls + 1)
+
+
+def stage(name: str):
+    """
+    Context manager timing a pipeline stage, a shared no-op when instrumentation is off
+    """
+    return _Stage(name) if enabled else _null
+
+def count(name: str, n: int = 1):
+    """
+    Adds n to a counter (points sampled, accepted, rejected, structures written, ...)
+    """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + int(n)
+
+def merge(data: dict):
+    """
+    Adds the report() of another process, e.g. a pool worker, to the running totals
+    """
+    if not enabled:
+        return
+    for name, stage in data.get("stages", {}).items():
+        total, calls = _timings.get(name, (0.0, 0))
+        _timings[name] = (total + stage["seconds"], calls + stage["calls"])
+    for name, n in data.get("counters", {}).items():
+        count(name, n)
+
+def reset():
+    _timings.clear()
+    _counters.clear()
+
+def report() -> dict:
+    """
+    The timings and counters collected so far
+    """
+    return {
+        "stages": {name: {"seconds": total, "calls": calls} for name, (total, calls) in _timings.items()},
+        "counters": dict(_counters),
+    }
+
+def _write(data: dict, path: str = None):
+    text = json.dumps(data, indent=1)
+    if path in (None, "", "1", "-"):
+        print(text, file=sys.stderr)
+    else:
+        with open(path, "w") as f:
+            f.write(text)
+
+
+@contextlib.contextmanager
+def run(path: str = None, profile: bool = False, memory: bool = False, top: int = 25):
+    """
+    Enables instrumentation for a block and writes its JSON report to path (stderr when path is None)
+    profile adds the top cProfile entries by cumulative time, memory adds the tracemalloc peak
+
+        with instrument.run("screen.json", profile=True):
+            generateStructures(host, ligand)
+    """
+    global enabled
+    previous = enabled
+    enabled = True
+    reset()
+
+    #the profilers are only imported when asked for, instrument is imported by every command line entry point
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    start = time.perf_counter()
+    data = {}
+    try:
+        yield data
+    finally:
+        data.update(report())
+        data["wall_time"] = time.perf_counter() - start
+        if profiler:
+            import io
+            import pstats
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+            data["profile"] = stream.getvalue()
+        if memory:
+            data["peak_memory"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        _write(data, path)
+        enabled = previous
+
+
+#process-wide instrumentation, reported at exit
+if os.environ.get("TURBOCOORD_PROFILE"):
+    _with = os.environ.get("TURBOCOORD_PROFILE_WITH", "").replace(",", " ").split()
+    _process = run(os.environ["TURBOCOORD_PROFILE"], profile="profile" in _with, memory="memory" in _with)
+    _process.__enter__()
+    atexit.register(_process.__exit__, None, None, None)
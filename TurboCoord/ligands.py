@@ -0,0 +1,218 @@
+import os
+import tempfile
+import numpy as np
+from . import elements
+from . import hostcache
+from . import instrument
+from . import spatialTools as st
+from . import xyzio
+
+LIGAND_CACHE = os.environ.get("TURBOCOORD_LIGAND_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "turbocoord", "ligands"))
+
+#donor elements, in order of preference when several are equally exposed
+DONOR_ELEMENTS = ('N', 'P', 'O', 'S', 'As', 'Se', 'Te')
+#halogens only donate when the ligand has no donor element, a C-F of 2-fluoropyridine is less coordinated than its N
+HALOGENS = ('F', 'Cl', 'Br', 'I')
+
+_memo = hostcache.Memo(32) #ensembles already loaded by this process
+
+def find_donor(numbers, coords, bonds=None) -> int:
+    """
+    Index of the donor atom of a ligand
+    The donor is the least coordinated donor-element atom (ties broken by DONOR_ELEMENTS, then by index)
+    Without any donor element the least coordinated halogen is taken (ties broken by HALOGENS), then the least coordinated
+    heavy atom, and atom 0 for a single atom
+    """
+    numbers = np.asarray(numbers)
+    if bonds is None:
+        bonds = st.perceive_bonds(numbers, coords)
+    coordination = np.bincount(bonds.ravel(), minlength=len(numbers))
+
+    for symbols in (DONOR_ELEMENTS, HALOGENS):
+        preference = {elements.NUMBERS[symbol.lower()]: rank for rank, symbol in enumerate(symbols)}
+        candidates = [i for i, number in enumerate(numbers) if number in preference]
+        if candidates:
+            return min(candidates, key=lambda i: (coordination[i], preference[numbers[i]], i))
+    candidates = [i for i, number in enumerate(numbers) if number > 1] or [0]
+    return min(candidates, key=lambda i: (coordination[i], i))
+
+def binding_axis(coords, donor: int, bonds) -> np.ndarray:
+    """
+    Unit vector along which the donor binds (its lone pair direction)
+    It points away from the donor's neighbours, opposite to the sum of the unit bond vectors,
+    and falls back to the direction away from the centre of the ligand when the bonds cancel (e.g. linear donors)
+    """
+    coords = np.asarray(coords, dtype=float)
+    neighbours = np.concatenate((bonds[bonds[:, 0] == donor, 1], bonds[bonds[:, 1] == donor, 0]))
+
+    axis = np.zeros(3)
+    if len(neighbours):
+        bond_vectors = coords[neighbours] - coords[donor]
+        axis = -(bond_vectors / np.linalg.norm(bond_vectors, axis=1)[:, None]).sum(axis=0)
+    if np.linalg.norm(axis) < 1e-3:
+        axis = coords[donor] - coords.mean(axis=0)
+    if np.linalg.norm(axis) < 1e-3: #a single atom or a perfectly symmetric ligand
+        axis = np.array([0.0, 0.0, 1.0])
+    return axis / np.linalg.norm(axis)
+
+def align(coords, donor: int, axis) -> np.ndarray:
+    """
+    Moves the donor to the origin and rotates the binding axis onto +z
+    """
+    coords = np.asarray(coords, dtype=float) - coords[donor]
+    return coords @ st.rotation_matrices(axis, [0.0, 0.0, 1.0])[0].T
+
+
+class ConformerEnsemble:
+    """
+    A ligand as a stack of conformers sharing one atom order
+
+    conformers is a read-only (C, n, 3) array, every conformer has its donor at the origin and its binding axis along +z,
+    so placing it on a site is one rotation of +z onto the site and any spin about z is a spin about the binding axis
+    """
+
+    def __init__(self, key: str, numbers, donor: int, conformers) -> None:
+        self.key = key
+        self.numbers = numbers
+        self.donor = int(donor)
+        self.conformers = conformers
+        self.numbers.flags.writeable = False
+        self.conformers.flags.writeable = False
+
+    @property
+    def atoms(self) -> list[str]:
+        return elements.element_symbols(self.numbers)
+
+    def __len__(self) -> int:
+        return len(self.conformers)
+
+    def place(self, points, n_spins: int = 1) -> np.ndarray:
+        """
+        Every conformer on every point at every spin about the binding axis, as one tensor operation
+        Returns a (P, K, C, n, 3) array
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        if len(points) == 0:
+            return np.empty((0, n_spins) + self.conformers.shape)
+        angles = np.linspace(0, 2 * np.pi, n_spins, endpoint=False)
+        spins = st.spin_matrices([0.0, 0.0, 1.0], angles)[0] #(K, 3, 3) about the aligned binding axis
+        matrices = np.einsum('pij,kjl->pkil', st.rotation_matrices([0.0, 0.0, 1.0], -points), spins)
+        return np.einsum('pkij,cnj->pkcni', matrices, self.conformers) + points[:, None, None, None, :]
+
+    def sweep(self, points, tree, n_spins: int = 36, batch_size: int = 256):
+        """
+        Conformers x spins scan of every point, keeping the least hindered conformer and spin per point (see spatialTools.spin_scan)
+        Returns the best (P, n, 3) coordinates, conformer index, spin angle and minimum distance to the indexed atoms
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 3)
+        angles = np.linspace(0, 2 * np.pi, n_spins, endpoint=False)
+        n_conformers, n_atoms, _ = self.conformers.shape
+
+        best_coords = np.empty((len(points), n_atoms, 3))
+        best_conformers = np.empty(len(points), dtype=int)
+        best_angles = np.empty(len(points))
+        best_distances = np.empty(len(points))
+
+        #chunk over points so the (P, K, C, n, 3) intermediate stays bounded
+        for start in range(0, len(points), batch_size):
+            stop = min(start + batch_size, len(points))
+            placed = self.place(points[start:stop], n_spins).reshape(stop - start, n_spins * n_conformers, n_atoms, 3)
+            distances = st.clearance(placed, tree).min(axis=2) #(P, K * C)
+            best = np.argmax(distances, axis=1)
+            rows = np.arange(stop - start)
+
+            best_coords[start:stop] = placed[rows, best]
+            best_conformers[start:stop] = best % n_conformers
+            best_angles[start:stop] = angles[best // n_conformers]
+            best_distances[start:stop] = distances[rows, best]
+
+        return best_coords, best_conformers, best_angles, best_distances
+
+    def save(self, path: str) -> None:
+        """
+        Writes the ensemble, replacing path atomically
+        The cache is best-effort: when the cache directory cannot be written the ensemble simply stays in memory
+        """
+        staging = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, staging = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npz")
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, numbers=self.numbers, donor=self.donor, conformers=self.conformers)
+            os.replace(staging, path)
+        except OSError:
+            instrument.count("ligand_cache_write_errors")
+            if staging is not None and os.path.exists(staging):
+                os.unlink(staging)
+
+
+def build(xyzfile: str, donor: int = None, key: str = None) -> ConformerEnsemble:
+    """
+    Reads every frame of a (multi-frame) xyz file as one conformer of the same ligand
+    The donor and the bonds are found on the first frame, the binding axis of every conformer from its own geometry
+    """
+    frames = list(xyzio.iter_xyz(xyzfile))
+    if not frames:
+        raise ValueError(f"No frames in {xyzfile}")
+    numbers = elements.atomic_numbers(frames[0].elements)
+    if any(len(frame.coords) != len(numbers) for frame in frames):
+        raise ValueError(f"The conformers in {xyzfile} do not all have {len(numbers)} atoms")
+
+    bonds = st.perceive_bonds(numbers, frames[0].coords)
+    if donor is None:
+        donor = find_donor(numbers, frames[0].coords, bonds)
+    conformers = np.stack([align(frame.coords, donor, binding_axis(frame.coords, donor, bonds)) for frame in frames])
+    return ConformerEnsemble(key, numbers, donor, conformers)
+
+def load(xyzfile: str, donor: int = None, cache: bool = True) -> ConformerEnsemble:
+    """
+    Returns the conformer ensemble of a ligand xyz file, from this process, from the on-disk cache (see LIGAND_CACHE) or by building it
+    The cache is keyed by the content of the file and the requested donor, so editing the file rebuilds the ensemble
+    """
+    key = hostcache.hostKey(xyzfile) + ("" if donor is None else f"-{donor}")
+    if not cache:
+        return build(xyzfile, donor, key)
+    ensemble = _memo.get(key)
+    if ensemble is not None:
+        return ensemble
+
+    path = os.path.join(LIGAND_CACHE, key + ".npz")
+    with instrument.stage("ligand_cache"):
+        try:
+            with np.load(path) as data:
+                ensemble = ConformerEnsemble(key, data['numbers'], data['donor'], data['conformers'])
+            instrument.count("ligand_cache_hits")
+        except (OSError, KeyError, ValueError):
+            ensemble = build(xyzfile, donor, key)
+            ensemble.save(path)
+            instrument.count("ligand_cache_misses")
+    return _memo.put(key, ensemble)
+
+def screenConformers(coords, ensemble: ConformerEnsemble, n_points: int = 100, cutoff: float = 1.5, clash_cutoff: float = None, radii=(2.5,),
+                     refine_samples: int = 0, n_spins: int = 36, tree=None, host=None):
+    """
+    Samples the sites around a host and sweeps all conformers x spins of a ligand over them (see TurboCoord.screenHost)
+    host is the hostcache.Host of coords, when given its cached clearances and tree are used
+    Returns the accepted sites, the matching (S, n_ligand, 3) ligand coordinates and the index of the conformer kept on each site
+    """
+    if host is not None:
+        tree = host.tree
+    elif tree is None:
+        tree = st.spatial_index(coords)
+    if clash_cutoff is None:
+        clash_cutoff = cutoff
+
+    with instrument.stage("sphere"):
+        if host is not None:
+            sites = host.searchSites(radii, n_points, cutoff, refine_samples)
+        else:
+            sites = st.searchSites(coords, radii, n_points, cutoff, refine_samples, tree=tree)
+    instrument.count("points_accepted", len(sites))
+
+    with instrument.stage("placement"):
+        placements, conformers, _, distances = ensemble.sweep(sites['point'], tree, n_spins)
+
+    keep = distances >= clash_cutoff
+    instrument.count("structures_accepted", keep.sum())
+    instrument.count("structures_rejected", len(keep) - keep.sum())
+    return sites[keep], placements[keep], conformers[keep]
@@ -1,9 +1,9 @@
-from TurboCoord import *
+from TurboCoord.TurboCoord import *
 # import required module
 import os
 import numpy as np
-from TurboCoord import generateStructures
-from TurboCoord import filterStructures
+from TurboCoord.TurboCoord import generateStructures
+from TurboCoord.TurboCoord import filterStructures
 # assign directory
 directory = '../utils/test_folder'
  
@@ -0,0 +1,320 @@
+import itertools
+import numpy as np
+from scipy.spatial import cKDTree
+from . import instrument
+from . import spatialTools as st
+from .TurboCoord import CoordinationComplex, Ligand, LigandGroup, screenHost
+
+
+def compatibility(placements_a, placements_b, cutoff: float, chunk: int = 64) -> np.ndarray:
+    """
+    Pairwise compatibility of two sets of placed ligands, (S_a, n_a, 3) and (S_b, n_b, 3)
+    Returns an (S_a, S_b) boolean array, True where no atom of the two ligands is closer than cutoff
+    placements_a is processed chunk placements at a time, which bounds the number of close atom pairs held at once
+    """
+    n_a, n_b = placements_a.shape[1], placements_b.shape[1]
+    tree_b = cKDTree(placements_b.reshape(-1, 3))
+
+    compatible = np.ones((len(placements_a), len(placements_b)), dtype=bool)
+    for start in range(0, len(placements_a), chunk):
+        tree_a = cKDTree(placements_a[start:start + chunk].reshape(-1, 3))
+        close = tree_a.sparse_distance_matrix(tree_b, cutoff, output_type='ndarray') #every atom pair closer than cutoff
+        compatible[start + close['i'] // n_a, close['j'] // n_b] = False
+    return compatible
+
+def cap_footprints(points, half_angle: float, samples: int = 2000) -> np.ndarray:
+    """
+    Directions of a Fibonacci grid on the unit sphere that fall within half_angle of each point, (P, samples) boolean
+    """
+    directions = np.asarray(points, dtype=float)
+    directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+    return directions @ st.fibonacci_sphere(samples).T >= np.cos(half_angle)
+
+
+def symmetry_operations(numbers, coords, tolerance: float = 0.1, proper: bool = True) -> np.ndarray:
+    """
+    Rotations about the origin (the central atom) that map the host onto itself, (G, 3, 3) with the identity first
+    Improper rotations (mirror images) are only included with proper=False, they turn chiral ligands into their enantiomers
+    A reference pair of atoms is mapped onto every pair of the same elements, distances from the origin and distance apart,
+    and an operation is kept when every atom lands within tolerance of an atom of the same element
+    Hosts with all atoms on one line have a continuous symmetry, only the identity is returned for them
+    """
+    numbers = np.asarray(numbers)
+    coords = np.asarray(coords, dtype=float)
+    radii = np.linalg.norm(coords, axis=1)
+    identity = np.eye(3)[None]
+
+    #atoms alike to atom i: same element at the same distance from the origin
+    classes = [np.flatnonzero((numbers == numbers[i]) & (np.abs(radii - radii[i]) < tolerance)) for i in range(len(coords))]
+    off_centre = np.flatnonzero(radii > tolerance)
+    if len(off_centre) < 2:
+        return identity
+    a = min(off_centre, key=lambda i: len(classes[i]))
+    units = coords[off_centre] / radii[off_centre, None]
+    sines = np.linalg.norm(np.cross(units, coords[a] / radii[a]), axis=1)
+    partners = off_centre[sines > 0.1]
+    if len(partners) == 0:
+        return identity
+    b = min(partners, key=lambda i: len(classes[i]))
+
+    def frame(u, v):
+        e1 = u / np.linalg.norm(u)
+        e2 = v - (v @ e1) * e1
+        e2 /= np.linalg.norm(e2)
+        return np.stack((e1, e2, np.cross(e1, e2)))
+
+    reference = frame(coords[a], coords[b])
+    tree = cKDTree(coords)
+    operations = [np.eye(3)] #the identity first, np.unique below keeps the first of equal operations
+    for a2 in classes[a]:
+        for b2 in classes[b]:
+            if a2 == b2 or abs(np.linalg.norm(coords[a2] - coords[b2]) - np.linalg.norm(coords[a] - coords[b])) > 2 * tolerance:
+                continue
+            image = frame(coords[a2], coords[b2])
+            for handedness in (1.0,) if proper else (1.0, -1.0):
+                rotation = (image * [[1.0], [1.0], [handedness]]).T @ reference
+                distances, index = tree.query(coords @ rotation.T)
+                if distances.max() < tolerance and (numbers[index] == numbers).all() and len(np.unique(index)) == len(index):
+                    operations.append(rotation)
+
+    _, unique = np.unique(np.round(np.array(operations), 6).reshape(len(operations), -1), axis=0, return_index=True)
+    return np.array(operations)[np.sort(unique)]
+
+def symmetrize(sites, placements, operations, spacing: float):
+    """
+    Closes a candidate set under the operations: every site not within spacing of a kept one is kept with all its images,
+    placed by rotating its placement, images closer than spacing / 2 to a kept site (e.g. on a rotation axis) are skipped
+    Returns the sites and placements in the order of their seeds, each followed by its images
+    """
+    points = np.empty((0, 3))
+    kept = []
+    for j, point in enumerate(sites['point']):
+        if len(points) and np.linalg.norm(points - point, axis=1).min() < spacing:
+            continue
+        for g, rotation in enumerate(operations):
+            image = rotation @ point
+            if len(points) and np.linalg.norm(points - image, axis=1).min() < spacing / 2:
+                continue
+            points = np.vstack((points, image))
+            kept.append((j, g))
+
+    index = np.array([j for j, _ in kept], dtype=int)
+    rotations = operations[[g for _, g in kept]]
+    sites = sites[index]
+    sites['point'] = points
+    return sites, np.einsum('sij,snj->sni', rotations, placements[index])
+
+
+class MultiPlacement:
+    """
+    Branch-and-bound search for k ligands placed together around one host
+
+    Every ligand type is screened against the host once (TurboCoord.screenHost), which gives its candidate placements,
+    and the pairwise compatibility of all candidates is computed up front
+    The search then places the ligands one after another, intersecting the set of still compatible candidates with the
+    compatibility row of every placement, and prunes a partial assignment when
+        - fewer compatible candidates are left than ligands still to place
+        - the solid angle covered by the remaining candidates cannot hold a cap per remaining ligand
+          (compatible donors are at least ligand_cutoff apart, so each owns a cap that no other donor can enter)
+    Identical ligands are placed on increasing candidate indices, so permutations of the same combination are never visited,
+    and candidate sites are thinned to one per tolerance cell, so combinations that differ by less than tolerance are not repeated
+    Combinations related by a rotation of the host (symmetry_operations, atoms matched to within symmetry_tolerance) are
+    collapsed: the candidates are closed under the rotations (symmetrize) and a combination is only yielded when no rotation
+    maps it onto a lexicographically smaller one, symmetry_tolerance=0 turns this off
+    numbers (or host) gives the elements of the host atoms, without them atoms are matched by position only
+    """
+
+    def __init__(self, coords, ligands: list[Ligand], cutoff: float = 1.5, ligand_cutoff: float = 2.0, tolerance: float = 0.5, tree=None, host=None,
+                 numbers=None, symmetry_tolerance: float = 0.1, **options) -> None:
+
+        self.coords = coords
+        if host is not None:
+            tree = host.tree
+            numbers = host.numbers if numbers is None else numbers
+        self.tree = st.spatial_index(coords) if tree is None else tree
+        self.ligand_cutoff = ligand_cutoff
+
+        #identical ligands (the same object) share one candidate set, slots of the same type are kept next to each other
+        self.types = list({id(ligand): ligand for ligand in ligands}.values())
+        type_index = {id(ligand): t for t, ligand in enumerate(self.types)}
+        self.slots = sorted(type_index[id(ligand)] for ligand in ligands)
+
+        self.sites, self.placements = [], []
+        for ligand in self.types:
+            sites, placements = screenHost(coords, ligand, cutoff=cutoff, tree=self.tree, host=host, **options)
+            order = np.argsort(-sites['clearance'], kind='stable') #roomiest sites first
+            if tolerance:
+                #keep the roomiest site per tolerance cell, dense site sets would otherwise yield many copies of every combination
+                _, first = np.unique(np.floor(sites['point'][order] / tolerance), axis=0, return_index=True)
+                order = order[np.sort(first)]
+            self.sites.append(sites[order])
+            self.placements.append(placements[order])
+
+        #candidate permutations of every rotation but the identity, rotations whose images do not permute the candidates are dropped
+        self.permutations = []
+        if symmetry_tolerance:
+            with instrument.stage("symmetry"):
+                operations = symmetry_operations(np.zeros(len(coords), dtype=int) if numbers is None else numbers, coords, symmetry_tolerance)
+                spacing = max(tolerance, symmetry_tolerance)
+                if len(operations) > 1:
+                    for t, (sites, placements) in enumerate(zip(self.sites, self.placements)):
+                        self.sites[t], self.placements[t] = symmetrize(sites, placements, operations, spacing)
+                for rotation in operations[1:]: #symmetry_operations returns the identity first
+                    permutation = [cKDTree(sites['point']).query(sites['point'] @ rotation.T, distance_upper_bound=spacing / 2)[1] for sites in self.sites]
+                    if all((index < len(index)).all() and len(np.unique(index)) == len(index) for index in permutation): #missed images get index n
+                        self.permutations.append(permutation)
+            instrument.count("symmetry_operations", len(self.permutations) + 1)
+
+        with instrument.stage("compatibility"):
+            self.compatible = [[compatibility(a, b, ligand_cutoff) for b in self.placements] for a in self.placements]
+            #a pair only counts as compatible when all its images are, so the rotations map valid combinations onto valid ones
+            for permutation in self.permutations:
+                for a, b in itertools.product(range(len(self.types)), repeat=2):
+                    self.compatible[a][b] &= self.compatible[a][b][np.ix_(permutation[a], permutation[b])]
+
+        #smallest image of every candidate of the first type: a canonical combination starts with the smallest candidate of its orbit,
+        #and no other candidate of that type has an image below it
+        self.orbit_min = np.arange(len(self.sites[self.slots[0]]))
+        for permutation in self.permutations:
+            self.orbit_min = np.minimum(self.orbit_min, permutation[self.slots[0]])
+
+        #solid-angle bound: two compatible donors at radii r1, r2 <= r_max with |r1 - r2| <= dr are at least
+        #2 * arcsin(sqrt(ligand_cutoff**2 - dr**2) / (2 * r_max)) apart as seen from the central atom
+        radii = np.concatenate([sites['radius'] for sites in self.sites])
+        self.footprints = None
+        if len(radii) and ligand_cutoff > np.ptp(radii):
+            half_angle = np.arcsin(min(1.0, np.sqrt(ligand_cutoff ** 2 - np.ptp(radii) ** 2) / (2 * radii.max())))
+            self.footprints = [cap_footprints(sites['point'], half_angle) for sites in self.sites]
+            self.cap_size = min(footprint.sum(axis=1).min(initial=footprint.shape[1]) for footprint in self.footprints)
+
+    def _bounded(self, free, depth: int) -> bool:
+        """
+        True when the partial assignment can still be completed from the free candidates
+        """
+        remaining = np.bincount(self.slots[depth:], minlength=len(self.types))
+        if any(mask.sum() < needed for mask, needed in zip(free, remaining)):
+            return False
+        if self.footprints is None:
+            return True
+        covered = np.zeros(self.footprints[0].shape[1], dtype=bool)
+        for t in np.flatnonzero(remaining):
+            covered |= self.footprints[t][free[t]].any(axis=0)
+        instrument.count("solid_angle_checks")
+        return covered.sum() >= remaining.sum() * self.cap_size
+
+    def _canonical(self, combinations) -> np.ndarray:
+        """
+        Mask of the (M, k) combinations (candidate index per slot) that no rotation maps onto a lexicographically smaller one
+        """
+        slots = np.array(self.slots)
+        groups = [np.flatnonzero(slots == t) for t in np.unique(slots)] #slots of one type are contiguous
+        keep = np.ones(len(combinations), dtype=bool)
+        rows = np.arange(len(combinations))
+        for permutation in self.permutations:
+            images = np.column_stack([permutation[t][combinations[:, slot]] for slot, t in enumerate(slots)])
+            for group in groups: #order the images as the search orders candidates
+                images[:, group] = np.sort(images[:, group], axis=1)
+            differs = images != combinations
+            first = np.argmax(differs, axis=1)
+            keep &= ~(differs.any(axis=1) & (images[rows, first] < combinations[rows, first]))
+        return keep
+
+    def _combinations(self):
+        """
+        Lazily yields (M, k) arrays of combinations (candidate index per slot), the last slot filled for all free candidates at once
+        """
+        def search(depth, chosen, free):
+            t = self.slots[depth]
+            if depth == len(self.slots) - 1:
+                last = np.flatnonzero(free[t])
+                yield np.column_stack([np.full(len(last), i) for i in chosen] + [last])
+                return
+            candidates = free[t] & (self.orbit_min == np.arange(len(self.orbit_min))) if depth == 0 else free[t]
+            for i in np.flatnonzero(candidates): #the first candidate is the smallest of its orbit
+                chosen.append(i)
+                after = [mask & self.compatible[t][u][i] for u, mask in enumerate(free)]
+                after[t][:i + 1] = False #identical ligands take increasing candidates, so permutations are never visited
+                if depth == 0:
+                    after[t] &= self.orbit_min >= i
+                if self._bounded(after, depth + 1):
+                    yield from search(depth + 1, chosen, after)
+                else:
+                    instrument.count("branches_pruned")
+                chosen.pop()
+
+        free = [np.ones(len(sites), dtype=bool) for sites in self.sites]
+        if self._bounded(free, 0):
+            yield from search(0, [], free)
+
+    def solutions(self, max_solutions: int = None, block_size: int = 4096):
+        """
+        Lazily yields every accepted combination as a list of (type, candidate index), one per slot
+        Combinations are collapsed under the rotations block_size at a time
+        """
+        found = 0
+        pending, size = [], 0
+        blocks = self._combinations()
+        while True:
+            block = next(blocks, None)
+            if block is not None:
+                pending.append(block)
+                size += len(block)
+                if size < block_size:
+                    continue
+            if not pending:
+                return
+
+            combinations = np.concatenate(pending)
+            pending, size = [], 0
+            if self.permutations:
+                keep = self._canonical(combinations)
+                instrument.count("symmetry_duplicates", len(keep) - keep.sum())
+                combinations = combinations[keep]
+            for combination in combinations.tolist():
+                if max_solutions is not None and found >= max_solutions:
+                    return
+                found += 1
+                yield list(zip(self.slots, combination))
+
+    def assemble(self, solution) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sites (SITE_DTYPE, one per slot) and concatenated ligand coordinates of one combination
+        """
+        sites = np.array([self.sites[t][i] for t, i in solution], dtype=st.SITE_DTYPE)
+        return sites, np.concatenate([self.placements[t][i] for t, i in solution])
+
+
+def saturateHost(coords, ligands: list[Ligand], max_solutions: int = None, **options) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Places all ligands together around a host given as a coordinate array (see MultiPlacement for the options)
+    Returns the (M, k) sites and the (M, n_total, 3) ligand coordinates of every accepted combination
+    """
+    search = MultiPlacement(coords, ligands, **options)
+    with instrument.stage("multi_placement"):
+        combinations = [search.assemble(solution) for solution in search.solutions(max_solutions)]
+    instrument.count("combinations_accepted", len(combinations))
+
+    if not combinations:
+        return np.empty((0, len(ligands)), dtype=st.SITE_DTYPE), np.empty((0, sum(len(search.types[t].coords) for t in search.slots), 3))
+    sites, placements = zip(*combinations)
+    return np.stack(sites), np.stack(placements)
+
+def generateMultiStructures(xyzfile: str, ligand_xyzfiles: list[str], max_solutions: int = None, **options) -> list[CoordinationComplex]:
+    """
+    Generates CoordinationComplex objects with one ligand per entry of ligand_xyzfiles (repeat a file for several copies)
+    The ligands of each structure are stored together as its ligand (a LigandGroup), so the structures can be filtered and written as usual
+    """
+    ligands = {path: Ligand(path) for path in dict.fromkeys(ligand_xyzfiles)}
+    complex = CoordinationComplex(xyzfile, ligand_xyzfiles[0])
+    sequence = [ligands[ligand_xyzfile] for ligand_xyzfile in ligand_xyzfiles]
+
+    search = MultiPlacement(complex.coords, sequence, host=complex.host, **options)
+    complex.set_ligand(LigandGroup([search.types[t] for t in search.slots])) #in slot order, as search.assemble concatenates them
+
+    structures = []
+    with instrument.stage("multi_placement"):
+        for solution in search.solutions(max_solutions):
+            sites, ligand_coords = search.assemble(solution)
+            structures.append(complex.with_ligand(ligand_coords, sites))
+    instrument.count("structures_generated", len(structures))
+    return structures
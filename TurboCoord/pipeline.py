@@ -0,0 +1,236 @@
+import os
+from collections import namedtuple
+import numpy as np
+from . import comparator
+from . import hostcache
+from . import instrument
+from . import sampling
+from . import spatialTools as st
+from . import xyzio
+from .TurboCoord import Ligand
+
+#A screening pipeline is a chain of generators, each consuming and yielding Batch objects of at most batch_size candidates:
+#
+#    batches = sites(host.coords, host=host)               #sphere points
+#    batches = place(batches, ligand, n_spins=36)          #placement
+#    batches = clash_filter(batches, host.tree, 1.5)       #clash filter
+#    batches = score(batches, host.tree)                   #scoring
+#    batches = dedup(batches, host.tree, 0.1)              #dedup
+#    archive_sink(batches, writer)                         #sink
+#
+#Nothing runs until the sink pulls, only one batch per stage is alive at a time, and the sink sees the first
+#candidates while the later shells are still being sampled
+#The sphere is generated batch_size points at a time (cached clearances are read from their memory-mapped file a slice
+#at a time) and dedup keeps at most max_kept placements, so memory does not grow with n_points
+
+#sites is a structured array (spatialTools.SITE_DTYPE), coords the (S, n_ligand, 3) placed ligands and scores an (S,) array
+Batch = namedtuple("Batch", ["sites", "coords", "scores"], defaults=(None, None))
+
+def sites(coords, radii=(2.5,), samples: int = 100, cutoff: float = 1.5, refine_samples: int = 0, tree=None, batch_size: int = 1024, host=None):
+    """
+    Lazily yields the open sites of spatialTools.searchSites in batches of at most batch_size
+    The coarse sphere is generated batch_size points at a time and refinement caps are laid around a slice of its open points
+    at a time, so neither the coarse nor the dense points are ever all in memory
+    Refined points are deduplicated against the earlier open points of their shell that are still within reach, so the sites
+    are the same as those of searchSites
+    host is the hostcache.Host of coords, when given the coarse clearances come from its cache (see hostcache.Host.sphere_slices)
+    """
+    if host is not None:
+        tree = host.tree
+    elif tree is None:
+        tree = st.spatial_index(coords)
+    half_angle, separation = st.refinement(samples, refine_samples) #same caps as spatialTools.searchSites
+    seeds_per_batch = max(1, batch_size // (refine_samples + 1))
+
+    def coarse(radius):
+        #open points of the coarse sphere, a slice of the spiral at a time
+        if host is not None:
+            for sphere, coarse_clearance in host.sphere_slices(samples, radius, batch_size):
+                yield sphere[coarse_clearance > cutoff]
+            return
+        for start in range(0, samples, batch_size):
+            sphere = radius * sampling.fibonacci(samples, start, start + batch_size)
+            yield sphere[st.clearance(sphere, tree) > cutoff]
+
+    for shell, radius in enumerate(radii):
+        #the spiral runs down y, and a refined point stays within radius * half_angle of its seed, so open points further up
+        #than that (plus the duplicate separation) from the last seed can no longer meet a later refined point
+        reach = radius * (half_angle + separation)
+        history = np.empty((0, 3))
+        for seeds in coarse(radius):
+            for start in range(0, len(seeds), seeds_per_batch):
+                points = [seeds[start:start + seeds_per_batch]]
+                if refine_samples:
+                    points.append(radius * st.fibonacci_cap(refine_samples, points[0], half_angle).reshape(-1, 3))
+                points = np.concatenate(points)
+
+                with instrument.stage("sphere"):
+                    point_clearance = st.clearance(points, tree)
+                mask = point_clearance > cutoff
+                open_points = np.concatenate((history, points[mask]))
+                mask[mask] = st.distinct_points(open_points, radius * separation)[len(history):]
+                last_seed = seeds[min(start + seeds_per_batch, len(seeds)) - 1]
+                history = open_points[open_points[:, 1] <= last_seed[1] + reach]
+
+                batch = np.empty(mask.sum(), dtype=st.SITE_DTYPE)
+                batch['point'] = points[mask]
+                batch['radius'] = radius
+                batch['shell'] = shell
+                batch['clearance'] = point_clearance[mask]
+                instrument.count("points_accepted", len(batch))
+                for chunk in range(0, len(batch), batch_size):
+                    yield Batch(batch[chunk:chunk + batch_size])
+
+def pocket_sites(numbers, coords, radius: float = 2.5, probe: float = 0.0, tree=None, batch_size: int = 1024, **options):
+    """
+    Yields the pocket openings of cavity.searchPockets in batches of at most batch_size, a drop-in replacement for sites
+    """
+    from . import cavity
+    with instrument.stage("pockets"):
+        found = cavity.searchPockets(numbers, coords, radius, probe=probe, tree=tree, **options)
+    instrument.count("points_accepted", len(found))
+    for start in range(0, len(found), batch_size):
+        yield Batch(found[start:start + batch_size])
+
+def place(batches, ligand: Ligand, n_spins: int = 0, tree=None):
+    """
+    Places the ligand on the sites of every batch, keeping the least hindered of n_spins spins when n_spins is given (needs tree)
+    """
+    for batch in batches:
+        with instrument.stage("placement"):
+            coords = st.place_ligand(ligand.coords, ligand.ligand_axis, batch.sites['point'])
+            if n_spins:
+                coords, *_ = st.spin_scan(coords, batch.sites['point'], tree, n_spins)
+        yield batch._replace(coords=coords)
+
+def clash_filter(batches, tree, cutoff: float):
+    """
+    Drops the placements with a ligand atom closer than cutoff to the host
+    """
+    for batch in batches:
+        with instrument.stage("filter"):
+            keep = ~st.clashes(batch.coords, tree, cutoff)
+        instrument.count("structures_accepted", keep.sum())
+        instrument.count("structures_rejected", len(keep) - keep.sum())
+        if keep.any():
+            yield Batch(batch.sites[keep], batch.coords[keep], None if batch.scores is None else batch.scores[keep])
+
+def score(batches, tree, function=None):
+    """
+    Scores every placement, by default with its smallest ligand - host distance (larger is better)
+    function maps the (S, n_ligand, 3) coordinates of a batch to (S,) scores
+    """
+    for batch in batches:
+        with instrument.stage("score"):
+            scores = st.clearance(batch.coords, tree).min(axis=1) if function is None else function(batch.coords)
+        yield batch._replace(scores=np.asarray(scores, dtype=float))
+
+def dedup(batches, tree, tolerance: float = 0.1, k: int = 8, max_kept: int = 100000):
+    """
+    Drops placements within tolerance of one already passed downstream, across batches (see comparator.Deduplicator)
+    Only the last max_kept placements passed downstream are remembered, None remembers all of them
+    """
+    deduplicator = comparator.Deduplicator(tree, tolerance, k, max_kept)
+    for batch in batches:
+        with instrument.stage("dedup"):
+            keep = deduplicator.add(batch.coords)
+        instrument.count("duplicates_dropped", len(batch.coords) - len(keep))
+        if len(keep):
+            yield Batch(batch.sites[keep], batch.coords[keep], None if batch.scores is None else batch.scores[keep])
+
+def rebatch(batches, batch_size: int = 1024):
+    """
+    Regroups the (possibly thinned out) batches of the previous stage into full batches of batch_size
+    """
+    pending, size = [], 0
+    for batch in batches:
+        pending.append(batch)
+        size += len(batch.sites)
+        while size >= batch_size:
+            merged = _concatenate(pending)
+            yield Batch(*(None if field is None else field[:batch_size] for field in merged))
+            pending = [Batch(*(None if field is None else field[batch_size:] for field in merged))]
+            size -= batch_size
+    if size:
+        yield _concatenate(pending)
+
+def _concatenate(batches) -> Batch:
+    if len(batches) == 1:
+        return batches[0]
+    return Batch(*(None if batches[0][i] is None else np.concatenate([batch[i] for batch in batches]) for i in range(len(Batch._fields))))
+
+
+#Sinks pull the pipeline to the end and return the number of candidates they received
+
+def archive_sink(batches, writer) -> int:
+    """
+    Appends every batch to an archive.ArchiveWriter
+    """
+    n_candidates = 0
+    for batch in batches:
+        with instrument.stage("write"):
+            writer.add(batch.sites, batch.coords, batch.scores)
+        n_candidates += len(batch.sites)
+    return n_candidates
+
+def xyz_sink(batches, filename: str, host_elements, host_coords, ligand_elements) -> int:
+    """
+    Appends every candidate as one frame (host + ligand) of a multi-frame xyz file
+    """
+    atoms = list(host_elements) + list(ligand_elements)
+    open(filename, 'w').close()
+    n_candidates = 0
+    for batch in batches:
+        with instrument.stage("write"):
+            frames = [(atoms, np.concatenate((host_coords, coords)), f"structure {n_candidates + i}") for i, coords in enumerate(batch.coords)]
+            xyzio.write_xyz(filename, frames, mode='a')
+        n_candidates += len(frames)
+        instrument.count("structures_written", len(frames))
+    return n_candidates
+
+def staging_sink(batches, directory: str, host_elements, host_coords, ligand_elements, freeze_host: bool = False) -> int:
+    """
+    Writes every candidate as a TURBOMOLE coord file in its own calculation directory (directory/candidate_i/coord),
+    ready for define (see autoDFT.define)
+    """
+    atoms = list(host_elements) + list(ligand_elements)
+    frozen = np.arange(len(atoms)) < len(host_coords) if freeze_host else None
+    n_candidates = 0
+    for batch in batches:
+        with instrument.stage("write"):
+            for coords in batch.coords:
+                workdir = os.path.join(directory, f"candidate_{n_candidates}")
+                os.makedirs(workdir, exist_ok=True)
+                xyzio.write_coord(os.path.join(workdir, "coord"), atoms, np.concatenate((host_coords, coords)), frozen)
+                n_candidates += 1
+        instrument.count("structures_written", len(batch.coords))
+    return n_candidates
+
+
+def streamStructures(xyzfile: str, ligand_xyzfile: str, n_points: int = 100, cutoff: float = 1.5, clash_cutoff: float = None, radii=(2.5,),
+                     refine_samples: int = 0, n_spins: int = 0, tolerance: float = None, batch_size: int = 1024, cache: bool = True, pockets: bool = False):
+    """
+    The streaming counterpart of generateStructures + filterStructures
+    Returns the host, the ligand and a lazy iterator of scored (and, with tolerance, deduplicated) batches, to be passed to a sink
+    With cache the coarse clearances of the host are read from (and added to) the host cache, see hostcache.py
+    With pockets the ligand is placed on the pocket openings of the host (pocket_sites, at the first radius) instead of sampled spheres
+
+        host, ligand, batches = streamStructures("host.xyz", "thf.xyz", n_points=5000, n_spins=36)
+        with ArchiveWriter("candidates.npz", elements.element_symbols(host.numbers), host.coords, ligand.atoms) as writer:
+            archive_sink(batches, writer)
+    """
+    host = hostcache.load(xyzfile, cache)
+    ligand = Ligand(ligand_xyzfile)
+    if clash_cutoff is None:
+        clash_cutoff = cutoff
+
+    if pockets:
+        batches = pocket_sites(host.numbers, host.coords, radii[0], tree=host.tree, batch_size=batch_size)
+    else:
+        batches = sites(host.coords, radii, n_points, cutoff, refine_samples, batch_size=batch_size, host=host if cache else None)
+    batches = place(batches, ligand, n_spins, tree=host.tree)
+    batches = clash_filter(batches, host.tree, clash_cutoff)
+    batches = score(batches, host.tree)
+    if tolerance:
+        batches = dedup(batches, host.tree, tolerance)
+    return host, ligand, rebatch(batches, batch_size)
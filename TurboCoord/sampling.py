@@ -0,0 +1,97 @@
+import functools
+import numpy as np
+
+
+def fibonacci(n: int, start: int = 0, stop: int = None) -> np.ndarray:
+    """
+    Fibonacci (golden angle) spiral from the north to the south pole, the point set of spatialTools.fibonacci_sphere
+    start and stop select points start..stop-1 of the n point spiral, so a large sphere can be generated in slices
+    """
+    i = np.arange(start, n if stop is None else min(stop, n))
+    phi = np.pi * (3.0 - np.sqrt(5.0)) # golden angle in radians
+    y = 1 - (i / float(max(n - 1, 1))) * 2 # y goes from 1 to -1
+    radius = np.sqrt(1 - y * y) # radius at y
+    theta = phi * i # golden angle increment
+    return np.stack((np.cos(theta) * radius, y, np.sin(theta) * radius), axis=1)
+
+def healpix(n: int) -> np.ndarray:
+    """
+    Centres of the HEALPix equal-area pixels (ring ordering) with nside chosen so that 12 * nside**2 is closest to n
+    """
+    nside = max(int(round(np.sqrt(n / 12))), 1)
+    n_pix = 12 * nside ** 2
+    n_cap = 2 * nside * (nside - 1)
+    p = np.arange(n_pix)
+    z = np.empty(n_pix)
+    phi = np.empty(n_pix)
+
+    north = p < n_cap
+    ring = np.floor((1 + np.sqrt(1 + 2 * p[north])) / 2)
+    j = p[north] - 2 * ring * (ring - 1) + 1
+    z[north] = 1 - ring ** 2 / (3 * nside ** 2)
+    phi[north] = (j - 0.5) * np.pi / (2 * ring)
+
+    equator = (p >= n_cap) & (p < n_pix - n_cap)
+    q = p[equator] - n_cap
+    ring = np.floor(q / (4 * nside)) + nside
+    j = q % (4 * nside) + 1
+    shift = (ring - nside + 1) % 2
+    z[equator] = 4 / 3 - 2 * ring / (3 * nside)
+    phi[equator] = (j - shift / 2) * np.pi / (2 * nside)
+
+    south = p >= n_pix - n_cap
+    q = n_pix - p[south]
+    ring = np.floor((1 + np.sqrt(2 * q - 1)) / 2)
+    j = 4 * ring + 1 - (q - 2 * ring * (ring - 1))
+    z[south] = -1 + ring ** 2 / (3 * nside ** 2)
+    phi[south] = (j - 0.5) * np.pi / (2 * ring)
+
+    radius = np.sqrt(1 - z * z)
+    return np.stack((radius * np.cos(phi), radius * np.sin(phi), z), axis=1)
+
+
+def _signed_permutations(point) -> np.ndarray:
+    """
+    Every distinct point obtained by permuting the components of point and flipping their signs (the octahedral orbit)
+    """
+    x, y, z = point
+    perms = np.array([(x, y, z), (x, z, y), (y, x, z), (y, z, x), (z, x, y), (z, y, x)])
+    signs = np.array([(a, b, c) for a in (1, -1) for b in (1, -1) for c in (1, -1)])
+    orbit = (perms[:, None, :] * signs[None, :, :]).reshape(-1, 3)
+    return np.unique(np.round(orbit, 12), axis=0)
+
+_A1 = (1.0, 0.0, 0.0)
+_A2 = (np.sqrt(0.5), np.sqrt(0.5), 0.0)
+_A3 = (np.sqrt(1 / 3), np.sqrt(1 / 3), np.sqrt(1 / 3))
+
+#generators of the small Lebedev grids (the quadrature weights are not needed for sampling)
+LEBEDEV_ORBITS = {
+    6: (_A1,),
+    14: (_A1, _A3),
+    26: (_A1, _A2, _A3),
+    38: (_A1, _A3, (0.4597008433809831, 0.8880738339771153, 0.0)),
+    50: (_A1, _A2, _A3, (0.3015113445777636, 0.3015113445777636, 0.9045340337332909)),
+}
+
+def lebedev(n: int) -> np.ndarray:
+    """
+    Lebedev grid points, only the sizes in LEBEDEV_ORBITS are available
+    """
+    if n not in LEBEDEV_ORBITS:
+        raise ValueError(f"No Lebedev grid with {n} points, available sizes are {sorted(LEBEDEV_ORBITS)}")
+    return np.concatenate([_signed_permutations(orbit) for orbit in LEBEDEV_ORBITS[n]])
+
+
+SCHEMES = {"fibonacci": fibonacci, "healpix": healpix, "lebedev": lebedev}
+
+@functools.lru_cache(maxsize=64)
+def unit_sphere(scheme: str = "fibonacci", n: int = 100) -> np.ndarray:
+    """
+    Point set on the unit sphere, memoized on (scheme, n)
+    The returned (N,3) array is shared between callers and therefore read-only, copy it before changing it in place
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown sampling scheme {scheme}, expected one of {sorted(SCHEMES)}")
+    points = SCHEMES[scheme](int(n))
+    points.setflags(write=False)
+    return points
@@ -1,5 +1,9 @@
 import numpy as np
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
+from . import elements
+from . import sampling
+from . import xyzio
 
 def set_origin(coords):
     """
@@ -10,36 +14,20 @@ def set_origin(coords):
     return coords
 
 
-def from_xyz(xyzfile: str):
+def from_xyz(xyzfile: str, distances: bool = False):
     """
     Reads in an xyz file and returns an a numpy array of xyz coordinates and atom names
+    The distance matrix is only computed when distances is True, otherwise None is returned in its place
     """
+    frame = xyzio.read_xyz(xyzfile)
+    atoms = frame.elements
+    indices = list(range(len(atoms)))
 
-    #Read the first line of the file to get the number of atoms
-    with open(xyzfile, 'r') as f:
-        n_atoms = int(f.readline())
-        #skip the second line
-        f.readline()
-        #Initialize the Nx3 xyz array with the number of atoms
-        coords = np.zeros((n_atoms, 3))
-        #Initialize the list of atom names
-        atoms = []
-        indices = []
-        #Loop over the lines in the file
-        for i, line in enumerate(f):
-            #Split the line into a list of strings
-            line = line.split()
-            #Add the atom name to the list
-            atoms.append(line[0])
-            indices.append(i)
-            #Add the xyz coordinates to the array
-            coords[i, :] = line[1:]
-    
     #set the origin to the first atom
-    coords = set_origin(coords)
-        
+    coords = set_origin(frame.coords)
+
     #Finally, find the distance array
-    dist_mat = cdist(coords, coords) #cdist is a function from scipy
+    dist_mat = cdist(coords, coords) if distances else None #cdist is a function from scipy
 
     return coords, atoms, indices, dist_mat
 
@@ -58,22 +46,204 @@ def rotation_matrix(vec1, vec2) -> np.ndarray:
     rotation_matrix = np.eye(3) + kmat + kmat.dot(kmat) * ((1 - c) / (s ** 2))
     return rotation_matrix
 
-def fibonacci_sphere(samples=100) -> list:
+def rotation_matrices(vec1, vec2) -> np.ndarray:
+    """ Batched version of rotation_matrix
+    vec1 is the ligand axis, shape (3,)
+    vec2 is a (P,3) array of target directions (usually the sampled sphere points)
+    returns a (P,3,3) stack of transform matrices, the p-th of which aligns vec1 with vec2[p]
+    """
+    a = np.asarray(vec1, dtype=float).reshape(3)
+    a = a / np.linalg.norm(a)
+    b = np.asarray(vec2, dtype=float).reshape(-1, 3)
+    b = b / np.linalg.norm(b, axis=1)[:, None]
+
+    v = np.cross(a, b) #(P,3)
+    c = b @ a #(P,)
+    kmat = np.zeros((len(b), 3, 3))
+    kmat[:, 0, 1], kmat[:, 0, 2] = -v[:, 2], v[:, 1]
+    kmat[:, 1, 0], kmat[:, 1, 2] = v[:, 2], -v[:, 0]
+    kmat[:, 2, 0], kmat[:, 2, 1] = -v[:, 1], v[:, 0]
+
+    #(1 - c)/s**2 == 1/(1 + c), which stays finite when the vectors are already aligned
+    antiparallel = np.isclose(c, -1.0)
+    scale = 1.0 / np.where(antiparallel, 1.0, 1.0 + c)
+    matrices = np.eye(3) + kmat + np.einsum('pij,pjk->pik', kmat, kmat) * scale[:, None, None]
+
+    if antiparallel.any():
+        #a half turn about any axis perpendicular to vec1
+        u = np.cross(a, np.eye(3)[np.argmin(np.abs(a))])
+        u /= np.linalg.norm(u)
+        matrices[antiparallel] = 2 * np.outer(u, u) - np.eye(3)
+
+    return matrices
+
+def axis_rotation_matrix(axis, theta: float) -> np.ndarray:
+    """
+    Rotation matrix (3x3) for a right-handed rotation by theta (radians) about axis
+    axis can be a vector or one of 'x', 'y', 'z'
+    """
+    if isinstance(axis, str):
+        axis = np.eye(3)['xyz'.index(axis)]
+    k = np.asarray(axis, dtype=float).reshape(3)
+    k = k / np.linalg.norm(k)
+    kmat = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + np.sin(theta) * kmat + (1 - np.cos(theta)) * kmat.dot(kmat)
+
+def spin_matrices(axes, angles) -> np.ndarray:
+    """
+    Batched axis_rotation_matrix
+    axes is a (P,3) array and angles a (K,) array, returns the (P,K,3,3) stack of rotations by every angle about every axis
+    """
+    k = np.asarray(axes, dtype=float).reshape(-1, 3)
+    k = k / np.linalg.norm(k, axis=1)[:, None]
+    angles = np.asarray(angles, dtype=float).reshape(-1)
+
+    kmat = np.zeros((len(k), 3, 3))
+    kmat[:, 0, 1], kmat[:, 0, 2] = -k[:, 2], k[:, 1]
+    kmat[:, 1, 0], kmat[:, 1, 2] = k[:, 2], -k[:, 0]
+    kmat[:, 2, 0], kmat[:, 2, 1] = -k[:, 1], k[:, 0]
+    kmat2 = np.einsum('pij,pjk->pik', kmat, kmat)
+
+    sin = np.sin(angles)[None, :, None, None]
+    cos = np.cos(angles)[None, :, None, None]
+    return np.eye(3) + sin * kmat[:, None] + (1 - cos) * kmat2[:, None]
+
+def spin_scan(placed, points, tree: cKDTree, n_spins: int = 72, batch_size: int = 1024):
+    """
+    Deterministic rotational scan of placed ligands about their binding axis (the central atom - point line)
+    Every ligand is spun through n_spins evenly spaced angles in one batched transform, scored by its minimum distance
+    to the indexed (host) atoms, and the least hindered spin is kept
+    Returns the best (P, n, 3) coordinates, the best angle and the minimum host distance of each site
+    """
+    placed = np.asarray(placed, dtype=float)
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    angles = np.linspace(0, 2 * np.pi, n_spins, endpoint=False)
+
+    best_coords = np.empty_like(placed)
+    best_angles = np.empty(len(points))
+    best_distances = np.empty(len(points))
+
+    #chunk over sites so the (P, K, n, 3) intermediate stays bounded
+    for start in range(0, len(points), batch_size):
+        stop = min(start + batch_size, len(points))
+        chunk = points[start:stop]
+        matrices = spin_matrices(chunk, angles)
+        spun = np.einsum('pkij,pnj->pkni', matrices, placed[start:stop] - chunk[:, None, :]) + chunk[:, None, None, :]
+
+        distances = clearance(spun, tree).min(axis=2) #(P, K)
+        best = np.argmax(distances, axis=1)
+        rows = np.arange(stop - start)
+
+        best_coords[start:stop] = spun[rows, best]
+        best_angles[start:stop] = angles[best]
+        best_distances[start:stop] = distances[rows, best]
+
+    return best_coords, best_angles, best_distances
+
+def place_ligand(ligand_coords, ligand_axis, points) -> np.ndarray:
+    """
+    Orients and translates a ligand onto every point in one batch
+    The ligand axis is aligned with the negative of each central atom - point bond (so the donor faces the central atom)
+    and the ligand origin is moved onto the point
+    returns an independent (P, n_ligand, 3) array of ligand coordinates
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if len(points) == 0:
+        return np.empty((0, len(ligand_coords), 3))
+
+    matrices = rotation_matrices(ligand_axis, -points)
+    return np.einsum('pij,nj->pni', matrices, ligand_coords) + points[:, None, :]
+
+def fibonacci_sphere(samples=100) -> np.ndarray:
     """
     Generates a sphere around the coordination complex
     Number of points is adjustable
+    Returns a shared, read-only (samples,3) array (see sampling.unit_sphere)
     """
-    points = []
-    phi = np.pi *(3.0 - np.sqrt(5.0))  # golden angle in radians
-    for i in range(samples):
-        y = 1 - (i / float(samples - 1)) * 2  # y goes from 1 to -1
-        radius = np.sqrt(1 - y * y)  # radius at y
-        theta = phi * i  # golden angle increment
-        x = np.cos(theta) * radius
-        z = np.sin(theta) * radius
-        points.append((x, y, z))
+    return sampling.unit_sphere("fibonacci", samples)
 
-    return points
+def fibonacci_cap(samples: int, axes, half_angle: float) -> np.ndarray:
+    """
+    Generates Fibonacci spaced unit vectors on a spherical cap of half_angle (radians) around each axis
+    axes is a (3,) vector or an (A,3) array, returns an (A, samples, 3) array
+    """
+    axes = np.asarray(axes, dtype=float).reshape(-1, 3)
+    golden = np.pi * (3.0 - np.sqrt(5.0))
+
+    i = np.arange(samples) + 0.5
+    z = 1 - (1 - np.cos(half_angle)) * i / samples #equal area steps down from the pole of the cap
+    radius = np.sqrt(1 - z * z)
+    theta = golden * i
+    cap = np.stack((np.cos(theta) * radius, np.sin(theta) * radius, z), axis=1)
+
+    #rotate the cap from the z axis onto each of the axes
+    matrices = rotation_matrices([0.0, 0.0, 1.0], axes)
+    return np.einsum('aij,nj->ani', matrices, cap)
+
+SITE_DTYPE = np.dtype([('point', float, 3), ('radius', float), ('shell', int), ('clearance', float)])
+
+def refinement(samples: int, refine_samples: int) -> tuple[float, float]:
+    """
+    Cap half-angle and duplicate separation (radians) of the coarse-to-fine search
+    The caps reach half the mean coarse spacing sqrt(4 pi / samples), so neighbouring caps only touch,
+    and refined points closer than half the mean fine spacing (pi / sqrt(samples * refine_samples)) count as duplicates
+    """
+    half_angle = 0.5 * np.sqrt(4 * np.pi / samples)
+    return half_angle, 0.5 * np.pi / np.sqrt(samples * max(refine_samples, 1))
+
+def distinct_points(points, tolerance: float) -> np.ndarray:
+    """
+    Mask keeping the first point (in input order) of every pair of points closer than tolerance
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    keep = np.ones(len(points), dtype=bool)
+    if len(points) > 1 and tolerance > 0:
+        pairs = cKDTree(points).query_pairs(tolerance, output_type='ndarray')
+        keep[pairs[:, 1]] = False
+    return keep
+
+def searchSites(coords, radii=(2.3, 2.5, 2.7), samples: int = 100, cutoff: float = 1.5, refine_samples: int = 50, tree=None) -> np.ndarray:
+    """
+    Coarse-to-fine search for open sites around the central atom
+    A sparse Fibonacci sphere is screened on every shell in radii, then a denser Fibonacci cap is laid around each open coarse point
+    (see refinement), and refined points that land on top of each other are kept once
+    The refined sites are about 180 / sqrt(samples * refine_samples) degrees apart, 2.5 degrees with the defaults,
+    sub-degree spacing needs samples * refine_samples above ~33000 (e.g. 100 coarse points and 350 per cap)
+    Returns a structured array (SITE_DTYPE) with the point, shell radius, shell index and clearance (distance to the nearest atom) of every open site
+    """
+    if tree is None:
+        tree = spatial_index(coords)
+
+    unit = fibonacci_sphere(samples)
+    sites = []
+    for shell, radius in enumerate(radii):
+        sphere = radius * unit
+        seeds = sphere[clearance(sphere, tree) > cutoff]
+        sites.append(shell_sites(seeds, radius, shell, tree, cutoff, samples, refine_samples))
+
+    return np.concatenate(sites) if sites else np.empty(0, dtype=SITE_DTYPE)
+
+def shell_sites(seeds, radius: float, shell: int, tree, cutoff: float, samples: int, refine_samples: int) -> np.ndarray:
+    """
+    The open sites of one shell of searchSites: the open coarse points seeds and the open points of the refinement caps
+    laid around them, refined points that land on top of each other kept once
+    """
+    half_angle, separation = refinement(samples, refine_samples)
+    points = [seeds]
+    if refine_samples and len(seeds):
+        points.append(radius * fibonacci_cap(refine_samples, seeds / radius, half_angle).reshape(-1, 3))
+    points = np.concatenate(points)
+
+    point_clearance = clearance(points, tree)
+    mask = point_clearance > cutoff
+    mask[mask] = distinct_points(points[mask], radius * separation)
+
+    sites = np.empty(mask.sum(), dtype=SITE_DTYPE)
+    sites['point'] = points[mask]
+    sites['radius'] = radius
+    sites['shell'] = shell
+    sites['clearance'] = point_clearance[mask]
+    return sites
 
 def generateSphere(xyzfile: str, samples: int, cutoff: float=1.26, radius: float = 2.5):
     """
@@ -83,24 +253,68 @@ def generateSphere(xyzfile: str, samples: int, cutoff: float=1.26, radius: float
     if xyzfile == None:
         raise Exception("No xyz file provided")
 
-    sphere = radius*np.array(fibonacci_sphere(samples))
+    sphere = radius*fibonacci_sphere(samples)
     coords, *_ = from_xyz(xyzfile)
     points = validPoints(sphere, coords, cutoff)
 
     return points
 
-def validPoints(points, coords, cutoff=1.3) -> tuple[list, list]:
+def validPoints(points, coords, cutoff=1.3, tree=None) -> tuple[np.ndarray, np.ndarray]:
     """
     Tests if one point in sphere is too close to a point in coords, if it is too close, remove the point
+    A prebuilt spatial index of coords can be passed as tree to skip rebuilding it
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    if tree is None:
+        tree = spatial_index(coords)
+
+    mask = clearance(points, tree) > cutoff
+    return points[mask], points[~mask]
+
+def spatial_index(coords) -> cKDTree:
+    """
+    Builds a KD-tree over a set of coordinates (usually the host complex) for neighbour queries
+    """
+    return cKDTree(np.asarray(coords, dtype=float).reshape(-1, 3))
+
+def clearance(points, tree: cKDTree) -> np.ndarray:
+    """
+    Distance from each point to its nearest atom in the spatial index
+    """
+    points = np.asarray(points, dtype=float)
+    distances, _ = tree.query(points.reshape(-1, 3))
+    return distances.reshape(points.shape[:-1])
+
+def perceive_bonds(numbers, coords, tolerance: float = 0.45) -> np.ndarray:
+    """
+    Finds bonded atom pairs from covalent radii
+    Two atoms are bonded when their distance is below the sum of their covalent radii plus tolerance
+    Candidate pairs come from a KD-tree neighbour search, so the cost grows linearly with the number of atoms
+    Returns an (E,2) array of atom indices with i < j
+    """
+    numbers = np.asarray(numbers)
+    coords = np.asarray(coords, dtype=float)
+    radii = elements.COVALENT_RADII[numbers]
+    if len(coords) < 2:
+        return np.zeros((0, 2), dtype=int)
+
+    #the largest possible bond length bounds the neighbour search
+    pairs = cKDTree(coords).query_pairs(2 * radii.max() + tolerance, output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    distances = np.linalg.norm(coords[i] - coords[j], axis=1)
+    bonded = (distances < radii[i] + radii[j] + tolerance) & (distances > 0.4)
+
+    return pairs[bonded]
+
+def clashes(placed, tree: cKDTree, cutoff: float) -> np.ndarray:
+    """
+    Checks a (S, n, 3) batch of placed ligands against the spatial index
+    Returns a boolean (S,) mask that is True where any ligand atom is within cutoff of any indexed atom
     """
-    valid = []
-    invalid = []
-    for point in points:
-        if np.all(cdist([point], coords) > cutoff):
-            valid.append(point)
-        else:
-            invalid.append(point)
-    return valid, invalid
+    placed = np.asarray(placed, dtype=float)
+    #neighbours beyond the cutoff are reported as inf, so the tree can stop searching early
+    distances, _ = tree.query(placed.reshape(-1, 3), distance_upper_bound=cutoff)
+    return (distances < cutoff).reshape(placed.shape[:-1]).any(axis=-1)
 
 
 def plot_sphere(xyzfile: str, samples: int, cutoff: float, radius: float = 2.5):
@@ -194,7 +408,7 @@ def plot_cdist_sphere(xyzfile: str, samples: int, cutoff: float, radius: float =
     import plotly.graph_objects as go
     import plotly.express as px
     coords, *_ = from_xyz(xyzfile)
-    sphere = radius*np.array(fibonacci_sphere(samples))
+    sphere = radius*fibonacci_sphere(samples)
     dist = cdist(coords, sphere)
     fig = px.imshow(dist)
     fig.show()
@@ -0,0 +1,241 @@
+import mmap
+import os
+import warnings
+from collections import namedtuple
+import numpy as np
+
+
+Frame = namedtuple('Frame', ['elements', 'coords', 'comment', 'frozen'], defaults=("", None))
+Frame.__doc__ = """
+One frame of an xyz file
+
+elements: list[str]
+    The element of every atom
+coords: np.ndarray
+    (N,3) array of coordinates in Angstrom
+comment: str
+    The comment (second) line of the frame
+frozen: np.ndarray or None
+    Boolean (N,) array of frozen atoms, only present for files written with freeze flags
+"""
+
+
+def _next_line(buf, pos: int) -> int:
+    """
+    Returns the offset just past the line starting at pos
+    """
+    end = buf.find(b'\n', pos)
+    return len(buf) if end == -1 else end + 1
+
+def _line_widths(block: bytes, n_atoms: int) -> np.ndarray:
+    """
+    Number of whitespace separated tokens on each of the n_atoms lines of block
+    """
+    chars = np.frombuffer(block, dtype=np.uint8)
+    blank = chars <= ord(' ') #space, tab, newline and the other control characters
+    starts = ~blank & np.concatenate(([True], blank[:-1])) #first character of every token
+    newline = chars == ord('\n')
+    line = np.cumsum(newline) - newline
+    return np.bincount(line[starts], minlength=n_atoms)[:n_atoms]
+
+def _parse_block(block: bytes, n_atoms: int):
+    """
+    Parses the atom lines of one frame in a single vectorized pass
+    Lines are either 'El x y z' or 'El flag x y z' (the frozen format of Atom.frozen_line, flag 0 or -1)
+    Columns after the coordinates (charges, labels, ...) are ignored
+    When the lines do not all have the same number of columns they are parsed one at a time instead, from their first
+    4 (or 5 when frozen) columns
+    """
+    if n_atoms == 0:
+        return [], np.zeros((0, 3)), None
+    widths = _line_widths(block, n_atoms)
+    if widths.min() < 4:
+        line = block.splitlines()[np.argmin(widths)].decode().strip()
+        raise ValueError(f"Expected an element and 3 coordinates on every atom line, got '{line}'")
+    if (widths == widths[0]).all():
+        tokens = np.array(block.split()).reshape(n_atoms, -1)
+    else: #ragged, only the leading columns are kept so that extra ones cannot shift across rows
+        tokens = np.array([(line.split() + [b''])[:5] for line in block.splitlines()[:n_atoms]])
+    tokens = tokens.astype(str)
+
+    elements = tokens[:, 0].tolist()
+    if widths.min() >= 5 and np.isin(tokens[:, 1], ('0', '-1')).all():
+        frozen = tokens[:, 1] == '-1'
+        coords = tokens[:, 2:5].astype(float)
+    else:
+        frozen = None
+        coords = tokens[:, 1:4].astype(float)
+
+    return elements, coords, frozen
+
+def iter_xyz(xyzfile: str):
+    """
+    Lazily yields every frame of a (multi-frame) xyz file as a Frame
+    The file is memory-mapped, so only the frame being parsed is ever copied out of it
+    """
+    with open(xyzfile, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            pos = 0
+            size = len(buf)
+            while pos < size:
+                header_end = _next_line(buf, pos)
+                header = buf[pos:header_end].strip()
+                if not header: #tolerate blank lines between or after frames
+                    pos = header_end
+                    continue
+                n_atoms = int(header)
+
+                comment_end = _next_line(buf, header_end)
+                comment = buf[header_end:comment_end].decode().strip()
+
+                block_end = comment_end
+                for _ in range(n_atoms):
+                    block_end = _next_line(buf, block_end)
+
+                elements, coords, frozen = _parse_block(buf[comment_end:block_end], n_atoms)
+                yield Frame(elements, coords, comment, frozen)
+                pos = block_end
+
+def read_xyz(xyzfile: str, frame: int = 0) -> Frame:
+    """
+    Returns a single frame of an xyz file (the first one by default)
+    """
+    for i, current in enumerate(iter_xyz(xyzfile)):
+        if i == frame:
+            return current
+    raise IndexError(f"{xyzfile} has no frame {frame}")
+
+
+def format_frame(elements, coords, comment: str = "", frozen=None) -> str:
+    """
+    Formats one frame in the fixed-width layout used by Atom.line (or Atom.frozen_line/labile_line when frozen is given)
+    """
+    n_atoms = len(elements)
+    coords = np.asarray(coords, dtype=float).reshape(n_atoms, 3)
+
+    if frozen is None:
+        fmt = "{:<2}{:>15.5f}{:>15.5f}{:>15.5f}\n"
+        columns = [elements]
+    else:
+        fmt = "{:<2}{:^4}{:>15.5f}{:>15.5f}{:>15.5f}\n"
+        columns = [elements, np.where(frozen, -1, 0).tolist()]
+
+    values = np.empty((n_atoms, len(columns) + 3), dtype=object)
+    for i, column in enumerate(columns):
+        values[:, i] = column
+    values[:, len(columns):] = coords
+
+    return f"{n_atoms}\n{comment}\n" + (fmt * n_atoms).format(*values.ravel())
+
+def write_xyz(xyzfile: str, frames, mode: str = 'w'):
+    """
+    Writes frames into one multi-frame xyz file, formatting one frame at a time so long (lazy) iterables are never held in memory
+    frames is an iterable of Frame objects or (elements, coords[, comment[, frozen]]) tuples
+    """
+    with open(xyzfile, mode) as f:
+        for frame in frames:
+            f.write(format_frame(*frame))
+
+
+ANGSTROM_TO_BOHR = 1 / 0.529177210903
+
+def format_coord(elements, coords, frozen=None) -> str:
+    """
+    Formats a TURBOMOLE coord block ($coord ... $end) from coordinates in Angstrom
+    Frozen atoms are marked with the trailing 'f' flag
+    """
+    n_atoms = len(elements)
+    bohr = np.asarray(coords, dtype=float).reshape(n_atoms, 3) * ANGSTROM_TO_BOHR
+    flags = np.where(frozen, " f", "") if frozen is not None else [""] * n_atoms
+
+    values = np.empty((n_atoms, 5), dtype=object)
+    values[:, :3] = bohr
+    values[:, 3] = [element.lower() for element in elements]
+    values[:, 4] = flags
+
+    fmt = "{:>20.14f}{:>24.14f}{:>24.14f}      {}{}\n"
+    return "$coord\n" + (fmt * n_atoms).format(*values.ravel()) + "$end\n"
+
+def write_coord(coordfile: str, elements, coords, frozen=None):
+    """
+    Writes a TURBOMOLE coord file from coordinates in Angstrom
+    """
+    with open(coordfile, 'w') as f:
+        f.write(format_coord(elements, coords, frozen))
+
+def read_coord(coordfile: str) -> Frame:
+    """
+    Reads the $coord block of a TURBOMOLE coord (or control) file
+    Coordinates are converted from bohr to Angstrom and 'f' flags become the frozen array
+    """
+    rows = []
+    with open(coordfile, 'r') as f:
+        in_coord = False
+        for line in f:
+            if line.startswith('$'):
+                if in_coord:
+                    break
+                in_coord = line.startswith('$coord')
+                continue
+            if in_coord and line.strip():
+                rows.append(line.split())
+
+    elements = [row[3].capitalize() for row in rows]
+    coords = np.array([row[:3] for row in rows], dtype=float).reshape(-1, 3) / ANGSTROM_TO_BOHR
+    frozen = np.array([len(row) > 4 and row[4] == 'f' for row in rows], dtype=bool)
+    return Frame(elements, coords, "", frozen)
+
+def xyz_to_coord(xyzfile: str, coordfile: str = "coord", frame: int = 0):
+    """
+    Converts one frame of an xyz file (Angstrom) into a TURBOMOLE coord file (bohr), keeping freeze flags
+    """
+    current = read_xyz(xyzfile, frame)
+    write_coord(coordfile, current.elements, current.coords, current.frozen)
+
+def coord_to_xyz(coordfile: str = "coord", xyzfile: str = None, comment: str = ""):
+    """
+    Converts a TURBOMOLE coord file into an xyz file, frozen atoms are written with the -1 flag of Atom.frozen_line
+    """
+    current = read_coord(coordfile)
+    frozen = current.frozen if current.frozen.any() else None
+    write_xyz(xyzfile or os.path.splitext(coordfile)[0] + ".xyz", [(current.elements, current.coords, comment, frozen)])
+
+def split_frames(xyzfile: str, directory: str, coordfile: str = "coord") -> list[str]:
+    """
+    Writes every frame of a multi-frame xyz file into its own calculation directory (frame_0, frame_1, ...) as a TURBOMOLE coord file
+    Returns the created directories
+    """
+    directories = []
+    for i, current in enumerate(iter_xyz(xyzfile)):
+        subdir = os.path.join(directory, f"frame_{i}")
+        os.makedirs(subdir, exist_ok=True)
+        write_coord(os.path.join(subdir, coordfile), current.elements, current.coords, current.frozen)
+        directories.append(subdir)
+    return directories
+
+def convert_tree(root: str, to: str = "coord") -> int:
+    """
+    Converts every file of a directory tree in one direction
+    to='coord' turns the *.xyz of a directory into a 'coord' file next to it, to='xyz' turns every 'coord' file into <directory name>.xyz
+    A directory holds one calculation, so directories with several *.xyz files are skipped (with a warning) for to='coord'
+    Returns the number of files written
+    """
+    if to not in ("coord", "xyz"):
+        raise ValueError(f"Unknown target format {to}, expected 'coord' or 'xyz'")
+
+    converted = 0
+    for dirpath, _, filenames in os.walk(root):
+        if to == "coord":
+            xyzfiles = sorted(filename for filename in filenames if filename.endswith(".xyz"))
+            if len(xyzfiles) > 1:
+                warnings.warn(f"Skipping {dirpath}: {len(xyzfiles)} xyz files would all be written to the same coord file")
+            elif xyzfiles:
+                xyz_to_coord(os.path.join(dirpath, xyzfiles[0]), os.path.join(dirpath, "coord"))
+                converted += 1
+        elif "coord" in filenames:
+            name = os.path.basename(os.path.abspath(dirpath))
+            coord_to_xyz(os.path.join(dirpath, "coord"), os.path.join(dirpath, f"{name}.xyz"))
+            converted += 1
+    return converted
@@ -0,0 +1,165 @@
+import numpy as np
+from . import xyzio
+
+#Internal coordinates over stacks of frames
+#frames are (F, N, 3) arrays (a single (N, 3) geometry is treated as one frame), angles are in degrees
+#and the angle and dihedral conventions are those of gcutil (angle(i, j, k) has j as the central atom)
+
+def read_frames(xyzfile: str) -> tuple[list[str], np.ndarray]:
+    """
+    Reads every frame of a multi-frame xyz file (e.g. an optimisation trajectory) into one (F, N, 3) array
+    All frames must have the same atoms, the elements of the first frame are returned
+    """
+    elements, coords = None, []
+    for frame in xyzio.iter_xyz(xyzfile):
+        if elements is None:
+            elements = frame.elements
+        elif len(frame.elements) != len(elements):
+            raise ValueError(f"{xyzfile} mixes frames of {len(elements)} and {len(frame.elements)} atoms")
+        coords.append(frame.coords)
+    if elements is None:
+        raise ValueError(f"No frames in {xyzfile}")
+    return elements, np.stack(coords)
+
+def _frames(frames) -> np.ndarray:
+    frames = np.asarray(frames, dtype=float)
+    return frames[None] if frames.ndim == 2 else frames
+
+def _indices(indices, width: int) -> np.ndarray:
+    return np.asarray(indices, dtype=np.intp).reshape(-1, width)
+
+def bonds(frames, pairs) -> np.ndarray:
+    """
+    Distances between the atom pairs (B, 2) in every frame, returns (F, B)
+    """
+    frames, pairs = _frames(frames), _indices(pairs, 2)
+    return np.linalg.norm(frames[:, pairs[:, 0]] - frames[:, pairs[:, 1]], axis=-1)
+
+def angles(frames, triples) -> np.ndarray:
+    """
+    Bond angles i-j-k of the triples (A, 3) in every frame, j is the central atom, returns (F, A)
+    """
+    frames, triples = _frames(frames), _indices(triples, 3)
+    rij = frames[:, triples[:, 0]] - frames[:, triples[:, 1]]
+    rkj = frames[:, triples[:, 2]] - frames[:, triples[:, 1]]
+    cos_theta = (rij * rkj).sum(axis=-1)
+    sin_theta = np.linalg.norm(np.cross(rij, rkj), axis=-1)
+    return np.degrees(np.arctan2(sin_theta, cos_theta))
+
+def dihedrals(frames, quads) -> np.ndarray:
+    """
+    Dihedral angles i->j->k->l of the quads (D, 4) in every frame, in [-180, 180), returns (F, D)
+    """
+    frames, quads = _frames(frames), _indices(quads, 4)
+    i, j, k, l = (frames[:, quads[:, n]] for n in range(4))
+    rji, rkj, rlk = j - i, k - j, l - k
+    v1 = np.cross(rji, rkj)
+    v1 /= np.linalg.norm(v1, axis=-1, keepdims=True)
+    v2 = np.cross(rlk, rkj)
+    v2 /= np.linalg.norm(v2, axis=-1, keepdims=True)
+    m1 = np.cross(v1, rkj) / np.linalg.norm(rkj, axis=-1, keepdims=True)
+    chi = -180.0 - np.degrees(np.arctan2((m1 * v2).sum(axis=-1), (v1 * v2).sum(axis=-1)))
+    return np.where(chi < -180.0, chi + 360.0, chi)
+
+def connectivity(n_atoms: int) -> np.ndarray:
+    """
+    Default Z-matrix references, the same choice as gcutil.write_zmat
+    Row i holds the (bond, angle, dihedral) reference atoms of atom i, -1 where a reference is not defined
+    """
+    refs = np.full((n_atoms, 3), -1, dtype=np.intp)
+    if n_atoms > 1:
+        refs[1, 0] = 0
+    if n_atoms > 2:
+        refs[2, :2] = (0, 1)
+    i = np.arange(3, n_atoms)
+    refs[3:] = np.stack((i - 3, i - 2, i - 1), axis=1)
+    return refs
+
+def to_zmatrix(frames, refs=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Z-matrix values of every frame for the references refs (see connectivity)
+    Returns the bond lengths, angles and dihedrals as (F, N) arrays, NaN where the reference is not defined
+    """
+    frames = _frames(frames)
+    n_frames, n_atoms, _ = frames.shape
+    refs = connectivity(n_atoms) if refs is None else np.asarray(refs, dtype=np.intp)
+    atoms = np.arange(n_atoms)
+
+    values = np.full((3, n_frames, n_atoms), np.nan)
+    for column, measure in enumerate((bonds, angles, dihedrals)):
+        rows = np.flatnonzero(refs[:, column] >= 0)
+        if len(rows):
+            indices = np.column_stack((atoms[rows], refs[rows, :column + 1]))
+            values[column][:, rows] = measure(frames, indices)
+    return values[0], values[1], values[2]
+
+def to_cartesian(bond, angle, dihedral, refs=None) -> np.ndarray:
+    """
+    Rebuilds (F, N, 3) coordinates from (F, N) Z-matrix values (natural extension of reference frames, as gcutil.write_xyz)
+    The first atom is put at the origin, the second on the x axis and the third in the xy plane
+    Every atom is placed for all frames at once, so the cost is a loop over atoms and not over frames
+    """
+    bond, angle, dihedral = (np.atleast_2d(np.asarray(values, dtype=float)) for values in (bond, angle, dihedral))
+    n_frames, n_atoms = bond.shape
+    refs = connectivity(n_atoms) if refs is None else np.asarray(refs, dtype=np.intp)
+    theta, phi = np.radians(angle), np.radians(dihedral)
+
+    coords = np.zeros((n_frames, n_atoms, 3))
+    if n_atoms > 1:
+        coords[:, 1, 0] = bond[:, 1]
+    if n_atoms > 2:
+        #third atom in the xy plane, at the bond length from its bond reference and at the angle to its angle reference
+        c, b = coords[:, refs[2, 0]], coords[:, refs[2, 1]]
+        u = (b - c) / np.linalg.norm(b - c, axis=-1, keepdims=True)
+        perp = np.stack((-u[:, 1], u[:, 0], np.zeros(n_frames)), axis=-1)
+        coords[:, 2] = c + bond[:, 2, None] * (np.cos(theta[:, 2, None]) * u + np.sin(theta[:, 2, None]) * perp)
+
+    for n in range(3, n_atoms):
+        c, b, a = (coords[:, refs[n, m]] for m in range(3))
+        r = bond[:, n, None]
+        x = r * np.cos(theta[:, n, None])
+        y = r * np.cos(phi[:, n, None]) * np.sin(theta[:, n, None])
+        z = r * np.sin(phi[:, n, None]) * np.sin(theta[:, n, None])
+
+        bc = c - b
+        bc /= np.linalg.norm(bc, axis=-1, keepdims=True)
+        nv = np.cross(b - a, bc)
+        nv /= np.linalg.norm(nv, axis=-1, keepdims=True)
+        coords[:, n] = c - bc * x + np.cross(nv, bc) * y + nv * z
+    return coords
+
+def format_zmatrix(elements, bond, angle, dihedral, refs=None) -> str:
+    """
+    Z-matrix text of one frame in the layout of gcutil.write_zmat (1-based references)
+    """
+    n_atoms = len(elements)
+    refs = connectivity(n_atoms) if refs is None else np.asarray(refs, dtype=np.intp)
+    lines = []
+    for n, element in enumerate(elements):
+        line = f"{element:<3s}"
+        for ref, value in zip(refs[n], (bond[n], angle[n], dihedral[n])):
+            if ref < 0:
+                break
+            line += f" {ref + 1:>4d}  {value:>11.5f}"
+        lines.append(line.rstrip())
+    return "\n".join(lines) + "\n"
+
+def screen(frames, constraints) -> np.ndarray:
+    """
+    Keeps the frames whose internal coordinates are all within range
+    constraints is a list of (atoms, low, high), where 2, 3 or 4 atoms select a bond, an angle or a dihedral
+    A dihedral range with low > high wraps through 180 degrees, e.g. (150, -150) for an anti arrangement
+    Returns an (F,) boolean mask
+    """
+    frames = _frames(frames)
+    keep = np.ones(len(frames), dtype=bool)
+    measures = {2: bonds, 3: angles, 4: dihedrals}
+    for atoms, low, high in constraints:
+        if len(atoms) not in measures:
+            raise ValueError(f"Constraints are defined over 2, 3 or 4 atoms, got {atoms}")
+        values = measures[len(atoms)](frames, atoms)[:, 0]
+        if low <= high:
+            keep &= (values >= low) & (values <= high)
+        else:
+            keep &= (values >= low) | (values <= high)
+    return keep
@@ -0,0 +1,168 @@
+"""
+Benchmarks for the sampling -> filtering -> export pipeline
+
+Every stage is run on synthetic host complexes (a central atom surrounded by randomly packed atoms) over a grid of
+host sizes and sphere densities. Throughput and peak memory (tracemalloc) are written as JSON so that runs of
+different versions can be compared. generateStructures is reported cold (empty host cache, see hostcache.py) and
+warm (host served from the cache) as two stages; the host cache lives in the temporary work directory:
+
+    python benchmarks/pipeline.py --output before.json
+    python benchmarks/pipeline.py --quick
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from TurboCoord import hostcache
+from TurboCoord import sampling
+from TurboCoord import spatialTools as st
+from TurboCoord.TurboCoord import generateStructures, filterStructures
+
+LIGAND = os.path.join(ROOT, "TurboCoord", "thf.xyz")
+ATOMS = (20, 100, 500, 2000)
+POINTS = (100, 1000, 10000, 100000)
+
+
+def synthetic_host(n_atoms: int, filename: str, seed: int = 0, density: float = 0.08):
+    """
+    Writes an xyz file with a Yb atom at the origin and n_atoms - 1 C/H atoms packed at roughly molecular density,
+    leaving the first coordination sphere (r < 2.2) empty
+    """
+    rng = np.random.default_rng(seed)
+    radius = max((3 * n_atoms / (4 * np.pi * density)) ** (1 / 3), 3.5)
+    coords = []
+    while len(coords) < n_atoms - 1:
+        point = rng.uniform(-radius, radius, 3)
+        if 2.2 < np.linalg.norm(point) < radius:
+            coords.append(point)
+    elements = ["Yb"] + list(rng.choice(["C", "H"], n_atoms - 1))
+    coords = np.vstack(([0.0, 0.0, 0.0], coords))
+
+    with open(filename, "w") as f:
+        f.write(f"{n_atoms}\nsynthetic host\n")
+        for element, (x, y, z) in zip(elements, coords):
+            f.write(f"{element:<2}{x:>15.5f}{y:>15.5f}{z:>15.5f}\n")
+
+
+def measure(function, repeat: int, setup=None):
+    """
+    Best wall time of repeat runs, then one extra run under tracemalloc for the peak memory
+    setup is called (untimed) before every run
+    """
+    best = np.inf
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak, result
+
+
+def clear_host_cache():
+    """
+    Forgets every host of this process and of the on-disk cache, so the next run starts cold
+    """
+    hostcache.clear()
+    shutil.rmtree(hostcache.HOST_CACHE, ignore_errors=True)
+
+
+def benchmarks(atoms, points, repeat: int, save_count: int, workdir: str):
+    """
+    Yields one result dict per (stage, host size, sphere density)
+    """
+    hostcache.HOST_CACHE = os.path.join(workdir, "hosts") #never touch the user's cache
+    for n_points in points:
+        #clear the point set cache so that generation is measured, not the lookup
+        seconds, peak, _ = measure(lambda: (sampling.unit_sphere.cache_clear(), st.fibonacci_sphere(n_points)), repeat)
+        yield {"stage": "fibonacci_sphere", "atoms": None, "points": n_points, "seconds": seconds, "throughput": n_points / seconds, "unit": "sites/s", "peak_bytes": peak}
+
+    for n_atoms in atoms:
+        host = os.path.join(workdir, f"host_{n_atoms}.xyz")
+        synthetic_host(n_atoms, host)
+
+        seconds, peak, _ = measure(lambda: st.from_xyz(host), repeat)
+        yield {"stage": "from_xyz", "atoms": n_atoms, "points": None, "seconds": seconds, "throughput": 1 / seconds, "unit": "structures/s", "peak_bytes": peak}
+
+        coords, *_ = st.from_xyz(host)
+        for n_points in points:
+            sphere = 2.5 * np.array(st.fibonacci_sphere(n_points))
+            seconds, peak, _ = measure(lambda: st.validPoints(sphere, coords, 1.5), repeat)
+            yield {"stage": "validPoints", "atoms": n_atoms, "points": n_points, "seconds": seconds, "throughput": n_points / seconds, "unit": "sites/s", "peak_bytes": peak}
+
+            seconds, peak, structures = measure(lambda: generateStructures(host, LIGAND, n_points, 1.5), repeat, setup=clear_host_cache)
+            yield {"stage": "generateStructures", "atoms": n_atoms, "points": n_points, "seconds": seconds, "throughput": len(structures) / seconds, "unit": "structures/s", "peak_bytes": peak, "structures": len(structures)}
+
+            seconds, peak, structures = measure(lambda: generateStructures(host, LIGAND, n_points, 1.5), repeat) #the cold runs left the host cached
+            yield {"stage": "generateStructures_cached", "atoms": n_atoms, "points": n_points, "seconds": seconds, "throughput": len(structures) / seconds, "unit": "structures/s", "peak_bytes": peak, "structures": len(structures)}
+
+            seconds, peak, _ = measure(lambda: filterStructures(structures, 1.5), repeat)
+            yield {"stage": "filterStructures", "atoms": n_atoms, "points": n_points, "seconds": seconds, "throughput": len(structures) / seconds, "unit": "structures/s", "peak_bytes": peak, "structures": len(structures)}
+
+        sample = structures[:save_count]
+        def save():
+            for i, structure in enumerate(sample):
+                structure.save(os.path.join(workdir, f"structure_{i}.xyz"))
+        seconds, peak, _ = measure(save, repeat)
+        yield {"stage": "CoordinationComplex.save", "atoms": n_atoms, "points": None, "seconds": seconds, "throughput": len(sample) / seconds if sample else None, "unit": "structures/s", "peak_bytes": peak, "structures": len(sample)}
+
+
+def version() -> str:
+    """
+    The git revision of the tree being benchmarked, if there is one
+    """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TurboCoord sampling pipeline")
+    parser.add_argument("--atoms", type=int, nargs="+", default=ATOMS, help="host sizes in atoms")
+    parser.add_argument("--points", type=int, nargs="+", default=POINTS, help="sphere densities in points")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions per benchmark (the best is kept)")
+    parser.add_argument("--save-count", type=int, default=100, help="structures written in the save benchmark")
+    parser.add_argument("--quick", action="store_true", help="small grid for a smoke run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.atoms, args.points, args.repeat = (20, 100), (100, 1000), 1
+
+    report = {"version": version(), "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "results": []}
+    with tempfile.TemporaryDirectory() as workdir:
+        for result in benchmarks(args.atoms, args.points, args.repeat, args.save_count, workdir):
+            report["results"].append(result)
+            print(f"{result['stage']:<26}{str(result['atoms']):>6}{str(result['points']):>8}{result['seconds']:>12.4f} s{result['throughput'] or 0:>14.1f} {result['unit']}", file=sys.stderr)
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()